@@ -10,11 +10,21 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S",
 )
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from backend.routers import files, ai, terminal
+from backend.services import ai_service, plan_run_store
 
-app = FastAPI(title="Nexar Code Assistant", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    yield
+    await ai_service.shutdown()
+    plan_run_store.close()
+
+
+app = FastAPI(title="Nexar Code Assistant", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
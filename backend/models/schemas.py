@@ -137,6 +137,12 @@ class ActionType(str, Enum):
     REPORT_BLOCKER = "report_blocker"
 
 
+# Action-type groupings used by the executor, orchestrator and context builder.
+COMMAND_ACTIONS = frozenset({ActionType.RUN_COMMAND, ActionType.RUN_TESTS, ActionType.RUN_LINT, ActionType.RUN_BUILD})
+WRITE_ACTIONS = frozenset({ActionType.CREATE_FILE, ActionType.UPDATE_FILE, ActionType.APPLY_PATCH})
+USER_INPUT_ACTIONS = frozenset({ActionType.ASK_USER, ActionType.REQUEST_APPROVAL})
+
+
 class ActionFailurePolicy(BaseModel):
     strategy: str = "replan"  # retry | replan | ask_user | abort
     fallback_actions: list["ActionSpec"] = Field(default_factory=list)
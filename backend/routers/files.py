@@ -6,9 +6,9 @@ router = APIRouter(prefix="/api/files", tags=["files"])
 
 
 @router.get("/tree", response_model=list[FileItem])
-async def get_file_tree(path: str = ""):
+async def get_file_tree(path: str = "", depth: int | None = None):
     try:
-        return file_service.list_directory(path)
+        return file_service.list_directory(path, depth=depth)
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
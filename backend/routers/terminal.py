@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import APIRouter, HTTPException
 
 from backend.models.schemas import (
@@ -87,7 +89,14 @@ async def resize_terminal_session(session_id: str, req: TerminalSessionResizeReq
 @router.delete("/sessions/{session_id}")
 async def close_terminal_session(session_id: str):
     try:
-        terminal_manager.close_session(session_id)
+        # Waiting for the shell to exit can take up to 1.5s, so it runs in a thread. Detaching
+        # and closing master_fd stay on the event loop, where every other fd access happens.
+        session = terminal_manager.detach_session(session_id)
+        if session:
+            try:
+                await asyncio.to_thread(terminal_manager.terminate_session, session)
+            finally:
+                terminal_manager.release_session(session)
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to close session: {str(e)}")
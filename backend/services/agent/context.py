@@ -1,15 +1,23 @@
 from __future__ import annotations
 
+import time
 from pathlib import Path
 from typing import Any
 
-from backend.models.schemas import AIRequestSnapshot, ActionExecutionRecord, ActionType
+from backend.models.schemas import WRITE_ACTIONS, AIRequestSnapshot, ActionExecutionRecord, ActionType
 from backend.services import file_service
+from backend.services.agent.workspace import is_ignored, walk_workspace
 
 
 class ContextSnapshotBuilder:
     """Build compact context snapshot for planner iterations."""
 
+    # Seconds a workspace summary is reused when nothing was written through file_service.
+    workspace_ttl_sec = 10.0
+
+    def __init__(self):
+        self._workspace_cache: dict[tuple[str, int], tuple[float, int, dict[str, Any]]] = {}
+
     def build(
         self,
         req: AIRequestSnapshot,
@@ -24,14 +32,22 @@ class ContextSnapshotBuilder:
         }
 
     def _workspace_summary(self, max_files: int) -> dict[str, Any]:
-        root = Path(file_service.get_workspace_root())
+        root = file_service.get_workspace_root()
+        key = (root, max_files)
+        generation = file_service.workspace_generation()
+        cached = self._workspace_cache.get(key)
+        now = time.monotonic()
+        if cached and cached[1] == generation and now - cached[0] < self.workspace_ttl_sec:
+            return cached[2]
+        summary = self._scan_workspace(Path(root), max_files)
+        self._workspace_cache[key] = (now, generation, summary)
+        return summary
+
+    def _scan_workspace(self, root: Path, max_files: int) -> dict[str, Any]:
         files: list[str] = []
         total = 0
-        for path in root.rglob("*"):
-            if not path.is_file():
-                continue
-            rel = str(path.relative_to(root))
-            if self._ignored(rel):
+        for rel, is_dir in walk_workspace(str(root)):
+            if is_dir or is_ignored(rel):
                 continue
             total += 1
             if len(files) < max_files:
@@ -111,12 +127,5 @@ class ContextSnapshotBuilder:
             "failed": failed,
             "action_type_count": type_count,
             "recent": recent,
-            "has_write": any(r.action_type in {ActionType.CREATE_FILE, ActionType.UPDATE_FILE, ActionType.APPLY_PATCH} for r in action_history),
+            "has_write": any(r.action_type in WRITE_ACTIONS for r in action_history),
         }
-
-    def _ignored(self, rel_path: str) -> bool:
-        parts = set(rel_path.split("/"))
-        if parts.intersection({".git", "node_modules", "dist", "build", "__pycache__", ".idea"}):
-            return True
-        suffix = Path(rel_path).suffix.lower()
-        return suffix in {".png", ".jpg", ".jpeg", ".gif", ".ico", ".pdf", ".lock", ".mp4", ".zip"}
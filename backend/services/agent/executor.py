@@ -3,13 +3,18 @@ from __future__ import annotations
 import difflib
 import hashlib
 import re
+import shlex
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
 from typing import Any
 
 from backend.models.schemas import (
+    COMMAND_ACTIONS,
+    USER_INPUT_ACTIONS,
+    WRITE_ACTIONS,
     AIRequestSnapshot,
     AIResponse,
     ActionExecutionRecord,
@@ -19,6 +24,34 @@ from backend.models.schemas import (
     FileChange,
 )
 from backend.services import ai_service, file_service
+from backend.services.agent.workspace import is_ignored, walk_workspace
+
+_SYMBOL_RE = re.compile(r"^\s*(def|class|function)\s+([A-Za-z_][\w]*)")
+# Pipes, redirects, globs, expansions, env assignments etc. still need a real shell.
+_SHELL_SYNTAX_RE = re.compile(r"[|&;<>()$`\\*?~\[\]{}!#\n]|^\s*[A-Za-z_]\w*=")
+
+
+_HASH_CHUNK_CHARS = 1 << 20
+
+
+def _text_hash(text: str) -> str:
+    # Encode in slices so multi-MB contents never need a full-size UTF-8 copy.
+    h = hashlib.sha256()
+    for start in range(0, len(text), _HASH_CHUNK_CHARS):
+        h.update(text[start:start + _HASH_CHUNK_CHARS].encode("utf-8"))
+    return h.hexdigest()
+
+
+def _build_diff(path: str, before: str, after: str) -> str:
+    return "\n".join(
+        difflib.unified_diff(
+            before.splitlines(),
+            after.splitlines(),
+            fromfile=f"a/{path}",
+            tofile=f"b/{path}",
+            lineterm="",
+        )
+    )
 
 
 @dataclass
@@ -44,7 +77,7 @@ class ActionExecutor:
         try:
             output, file_changes, assistant_message, final_answer, blocked = await self._dispatch(req, action, history)
             status = "blocked" if blocked else "completed"
-            if blocked and action.type in {ActionType.ASK_USER, ActionType.REQUEST_APPROVAL}:
+            if blocked and action.type in USER_INPUT_ACTIONS:
                 status = "waiting_user"
             ended = datetime.utcnow().isoformat()
             return ActionExecutionOutcome(
@@ -106,9 +139,9 @@ class ActionExecutor:
             return self._summarize_context(history), [], None, None, False
         if action.type == ActionType.PROPOSE_SUBPLAN:
             return self._propose_subplan(action), [], None, None, False
-        if action.type in {ActionType.RUN_COMMAND, ActionType.RUN_TESTS, ActionType.RUN_LINT, ActionType.RUN_BUILD}:
+        if action.type in COMMAND_ACTIONS:
             return self._run_command(action), [], None, None, False
-        if action.type in {ActionType.CREATE_FILE, ActionType.UPDATE_FILE, ActionType.APPLY_PATCH}:
+        if action.type in WRITE_ACTIONS:
             out, changes = await self._write_file_action(req, action)
             return out, changes, None, None, False
         if action.type == ActionType.DELETE_FILE:
@@ -137,11 +170,10 @@ class ActionExecutor:
         root = Path(file_service.get_workspace_root())
         files: list[str] = []
         dirs: set[str] = set()
-        for path in root.rglob("*"):
-            rel = str(path.relative_to(root))
-            if self._ignored(rel):
+        for rel, is_dir in walk_workspace(str(root)):
+            if is_ignored(rel):
                 continue
-            if path.is_dir():
+            if is_dir:
                 dirs.add(rel)
                 continue
             files.append(rel)
@@ -200,22 +232,23 @@ class ActionExecutor:
         if paths:
             candidates = [root / p for p in paths]
         else:
-            candidates = [p for p in root.rglob("*") if p.is_file()]
+            candidates = [root / rel for rel, is_dir in walk_workspace(str(root)) if not is_dir]
         matches: list[dict[str, Any]] = []
         pattern = re.compile(re.escape(keyword), re.IGNORECASE)
         for file_path in candidates:
             rel = str(file_path.relative_to(root)) if file_path.is_absolute() else str(file_path)
-            if self._ignored(rel):
+            if is_ignored(rel):
                 continue
             try:
-                text = file_path.read_text(encoding="utf-8", errors="replace")
+                # Stream line by line so hitting the match limit stops reading the file.
+                with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                    for idx, line in enumerate(f, start=1):
+                        if pattern.search(line):
+                            matches.append({"path": rel, "line": idx, "text": line.rstrip("\n")[:240]})
+                            if len(matches) >= limit:
+                                return {"query": keyword, "matches": matches}
             except Exception:
                 continue
-            for idx, line in enumerate(text.splitlines(), start=1):
-                if pattern.search(line):
-                    matches.append({"path": rel, "line": idx, "text": line[:240]})
-                    if len(matches) >= limit:
-                        return {"query": keyword, "matches": matches}
         return {"query": keyword, "matches": matches}
 
     def _extract_symbols(self, action: ActionSpec) -> dict[str, Any]:
@@ -223,20 +256,27 @@ class ActionExecutor:
         if not paths:
             return {"symbols": [], "reason": "no_paths"}
         root = Path(file_service.get_workspace_root())
-        pat = re.compile(r"^\s*(def|class|function)\s+([A-Za-z_][\w]*)")
+        targets = paths[:50]
+        # File reads release the GIL, so scanning in a small pool overlaps the I/O.
+        with ThreadPoolExecutor(max_workers=min(16, len(targets))) as pool:
+            per_file = list(pool.map(lambda p: self._file_symbols(root, p), targets))
         symbols: list[dict[str, Any]] = []
-        for path in paths[:50]:
-            target = root / path
-            try:
-                text = target.read_text(encoding="utf-8", errors="replace")
-            except Exception:
-                continue
-            for idx, line in enumerate(text.splitlines(), start=1):
-                m = pat.search(line)
-                if m:
-                    symbols.append({"path": path, "line": idx, "kind": m.group(1), "name": m.group(2)})
+        for found in per_file:
+            symbols.extend(found)
         return {"symbols": symbols}
 
+    def _file_symbols(self, root: Path, path: str) -> list[dict[str, Any]]:
+        try:
+            text = (root / path).read_text(encoding="utf-8", errors="replace")
+        except Exception:
+            return []
+        found: list[dict[str, Any]] = []
+        for idx, line in enumerate(text.splitlines(), start=1):
+            m = _SYMBOL_RE.search(line)
+            if m:
+                found.append({"path": path, "line": idx, "kind": m.group(1), "name": m.group(2)})
+        return found
+
     def _analyze_dependencies(self, action: ActionSpec) -> dict[str, Any]:
         path = action.input.get("path")
         if not path:
@@ -281,14 +321,25 @@ class ActionExecutor:
         command = str(action.input.get("command") or "").strip()
         if not command:
             return {"command": "", "exit_code": 1, "stderr": "empty command"}
-        proc = subprocess.run(
-            command,
-            cwd=file_service.get_workspace_root(),
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=int(action.timeout_sec or 120),
-        )
+        run_kwargs: dict[str, Any] = {
+            "cwd": file_service.get_workspace_root(),
+            "capture_output": True,
+            "text": True,
+            "timeout": int(action.timeout_sec or 120),
+        }
+        argv = self._direct_argv(command)
+        try:
+            if argv is None:
+                proc = subprocess.run(command, shell=True, **run_kwargs)
+            else:
+                try:
+                    proc = subprocess.run(argv, **run_kwargs)
+                except FileNotFoundError:
+                    # Shell builtins (cd, export, ...) and unknown programs keep shell semantics.
+                    proc = subprocess.run(command, shell=True, **run_kwargs)
+        finally:
+            # The command may have created or removed files (mkdir, git clone, ...), even on timeout.
+            file_service.mark_workspace_changed()
         return {
             "command": command,
             "exit_code": proc.returncode,
@@ -296,6 +347,16 @@ class ActionExecutor:
             "stderr": (proc.stderr or "")[:4000],
         }
 
+    def _direct_argv(self, command: str) -> list[str] | None:
+        """Split a plain program invocation so it can run without an intermediate shell."""
+        if _SHELL_SYNTAX_RE.search(command):
+            return None
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            return None
+        return argv or None
+
     async def _write_file_action(self, req: AIRequestSnapshot, action: ActionSpec) -> tuple[dict[str, Any], list[FileChange]]:
         path = str(action.input.get("path") or "")
         content = action.input.get("content")
@@ -304,8 +365,10 @@ class ActionExecutor:
             raise ValueError("write action missing path")
 
         before = ""
+        before_hash = _text_hash("")
         try:
             before = file_service.read_file(path).content
+            before_hash = _text_hash(before)
         except Exception:
             before = ""
 
@@ -319,6 +382,7 @@ class ActionExecutor:
                 current_code=before,
                 snippets=req.snippets,
                 chat_only=False,
+                use_cache=False,
             )
             content = llm_resp.file_content
             if content is None and llm_resp.changes:
@@ -334,23 +398,15 @@ class ActionExecutor:
 
         file_service.write_file(path, str(content))
         after = str(content)
-        diff = "\n".join(
-            difflib.unified_diff(
-                before.splitlines(),
-                after.splitlines(),
-                fromfile=f"a/{path}",
-                tofile=f"b/{path}",
-                lineterm="",
-            )
-        )
+        diff = _build_diff(path, before, after)
         change = FileChange(
             file_path=path,
             file_content=after,
             before_content=before,
             after_content=after,
             diff_unified=diff,
-            before_hash=hashlib.sha256(before.encode("utf-8")).hexdigest(),
-            after_hash=hashlib.sha256(after.encode("utf-8")).hexdigest(),
+            before_hash=before_hash,
+            after_hash=_text_hash(after),
             write_result="written",
         )
         output = {"path": path, "before_len": len(before), "after_len": len(after)}
@@ -393,6 +449,7 @@ class ActionExecutor:
             messages=[ChatMessage(role="user", content=prompt)],
             chat_only=True,
             snippets=req.snippets,
+            use_cache=False,
         )
         output = {
             "satisfied": True,
@@ -407,10 +464,3 @@ class ActionExecutor:
             if msg.role == "user":
                 return msg.content
         return ""
-
-    def _ignored(self, rel_path: str) -> bool:
-        parts = set(rel_path.split("/"))
-        if parts.intersection({".git", "node_modules", "dist", "build", "__pycache__", ".idea"}):
-            return True
-        suffix = Path(rel_path).suffix.lower()
-        return suffix in {".png", ".jpg", ".jpeg", ".gif", ".ico", ".pdf", ".lock", ".mp4", ".zip"}
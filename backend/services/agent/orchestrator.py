@@ -1,9 +1,13 @@
 from __future__ import annotations
 
 import logging
+import re
 from datetime import datetime
 
 from backend.models.schemas import (
+    COMMAND_ACTIONS,
+    USER_INPUT_ACTIONS,
+    WRITE_ACTIONS,
     AIRequest,
     AIRequestSnapshot,
     AIResponse,
@@ -19,6 +23,9 @@ from backend.services.plan_run_store import PlanRunStore
 
 logger = logging.getLogger("agent_orchestrator")
 
+_EDIT_MARKERS = ("modify", "change", "edit", "fix", "重构", "修改", "修复", "优化", "改")
+_EDIT_MARKER_RE = re.compile("|".join(re.escape(m) for m in _EDIT_MARKERS))
+
 
 class ClosedLoopAgent:
     """Action-driven orchestrator: planning -> actions[] -> planning."""
@@ -31,8 +38,12 @@ class ClosedLoopAgent:
         self.max_retries = 3
 
     def create_run(self, req: AIRequest):
-        intent = self._infer_intent(req)
-        run = self.run_store.create_run(intent=intent, max_retries=self.max_retries, request=req)
+        # Convert once; intent inference and the run store share the same snapshot.
+        # from_attributes reuses the validated ChatMessage/CodeSnippet instances instead of
+        # dumping and rebuilding every message.
+        snapshot = AIRequestSnapshot.model_validate(req, from_attributes=True)
+        intent = self._infer_intent(snapshot)
+        run = self.run_store.create_run(intent=intent, max_retries=self.max_retries, request=snapshot)
         self.run_store.add_event(
             run,
             kind="system",
@@ -359,7 +370,7 @@ class ClosedLoopAgent:
                 run = self.run_store.get(run_id)
                 self.run_store.update_status(run, "waiting_user")
                 interrupt_status = "blocked" if outcome.blocked else "failed"
-                if outcome.blocked and action.type in {ActionType.ASK_USER, ActionType.REQUEST_APPROVAL}:
+                if outcome.blocked and action.type in USER_INPUT_ACTIONS:
                     interrupt_status = "waiting_user"
                 self.run_store.add_event(
                     run,
@@ -482,14 +493,13 @@ class ClosedLoopAgent:
             dfs(action.id)
         return ordered
 
-    def _infer_intent(self, req: AIRequest) -> str:
-        text = self._latest_user_query(AIRequestSnapshot(**req.model_dump())).lower()
+    def _infer_intent(self, req: AIRequestSnapshot) -> str:
+        text = self._latest_user_query(req).lower()
         if req.force_code_edit:
             return "code_edit"
         if req.chat_only:
             return "qa"
-        edit_markers = ("modify", "change", "edit", "fix", "重构", "修改", "修复", "优化", "改")
-        if req.current_file or req.file_path or any(m in text for m in edit_markers):
+        if req.current_file or req.file_path or _EDIT_MARKER_RE.search(text):
             return "code_edit"
         return "qa"
 
@@ -542,12 +552,12 @@ class ClosedLoopAgent:
             target = output.get("path") if isinstance(output, dict) else None
             return f"依赖分析完成：{target or 'N/A'}，依赖数 {dep_count if dep_count is not None else 'N/A'}"
 
-        if action.type in {ActionType.RUN_COMMAND, ActionType.RUN_TESTS, ActionType.RUN_LINT, ActionType.RUN_BUILD}:
+        if action.type in COMMAND_ACTIONS:
             cmd = output.get("command") if isinstance(output, dict) else ""
             code = output.get("exit_code") if isinstance(output, dict) else None
             return f"命令执行完成：{cmd} (exit={code if code is not None else 'N/A'})"
 
-        if action.type in {ActionType.CREATE_FILE, ActionType.UPDATE_FILE, ActionType.APPLY_PATCH}:
+        if action.type in WRITE_ACTIONS:
             path = output.get("path") if isinstance(output, dict) else None
             before_len = output.get("before_len") if isinstance(output, dict) else None
             after_len = output.get("after_len") if isinstance(output, dict) else None
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import os
+from typing import Iterator
+
+IGNORED_DIRS = frozenset({".git", "node_modules", "dist", "build", "__pycache__", ".idea"})
+BINARY_SUFFIXES = frozenset({".png", ".jpg", ".jpeg", ".gif", ".ico", ".pdf", ".lock", ".mp4", ".zip"})
+
+
+def is_ignored(rel_path: str) -> bool:
+    for part in rel_path.split("/"):
+        if part in IGNORED_DIRS:
+            return True
+    return os.path.splitext(rel_path)[1].lower() in BINARY_SUFFIXES
+
+
+def walk_workspace(root: str) -> Iterator[tuple[str, bool]]:
+    """Yield (relative_path, is_dir) under root, pruning ignored directories before descending."""
+    stack: list[tuple[str, str]] = [("", root)]
+    while stack:
+        rel_dir, abs_dir = stack.pop()
+        try:
+            entries = os.scandir(abs_dir)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name in IGNORED_DIRS:
+                            continue
+                        stack.append((rel, entry.path))
+                        yield rel, True
+                    elif entry.is_file():
+                        yield rel, False
+                except OSError:
+                    continue
@@ -1,8 +1,15 @@
 import os
+import asyncio
 import json
 import re
+import hashlib
 import logging
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
+from typing import AsyncGenerator, Awaitable, Callable
+from pydantic import BaseModel
 from backend.models.schemas import (
     AIProvider,
     ChatMessage,
@@ -18,19 +25,65 @@ from backend.models.schemas import (
     ActionSpec,
     ActionType,
 )
+from backend.services.file_service import line_offsets
+from backend.services.semantic_cache import SemanticCache
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback keeps the backend usable without the C extension
+    orjson = None
+
+# Provider SDKs are imported once here; a missing one only disables that provider.
+try:
+    import openai
+except ImportError:
+    openai = None
+try:
+    import anthropic
+except ImportError:
+    anthropic = None
+try:
+    import httpx
+except ImportError:
+    httpx = None
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
 
 logger = logging.getLogger("ai_service")
 
+# Receives each text delta while a provider response is streaming.
+TokenCallback = Callable[[str], Awaitable[None]]
+
 LOG_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "logs")
-os.makedirs(LOG_DIR, exist_ok=True)
+
+
+def _json_loads(text: str | bytes):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _json_dumpb(obj) -> bytes:
+    """Serialize to UTF-8 JSON bytes (non-ASCII kept as-is, like ensure_ascii=False)."""
+    if orjson is not None:
+        # json.dumps coerces int/None dict keys to strings; keep that behaviour.
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _json_dumps(obj) -> str:
+    return _json_dumpb(obj).decode("utf-8")
 
 
 def _estimate_tokens_from_messages(messages: list[dict]) -> int:
     total_chars = 0
     for msg in messages:
-        if not isinstance(msg, dict):
-            continue
-        total_chars += len(str(msg.get("content", "")))
+        if isinstance(msg, dict):
+            content = msg.get("content", "")
+            total_chars += len(content) if isinstance(content, str) else len(str(content))
     return max(1, total_chars // 4)
 
 
@@ -65,6 +118,193 @@ def _build_llm_call_meta(
     }
 
 
+class _LogWriter:
+    """Append AI log records through one long-lived handle, coalescing bursts into a single write."""
+
+    max_batch = 64
+    max_delay_sec = 0.05
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._date = ""
+        self._fh = None
+        self._dir_ready = False
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    def submit(self, date: str, record: dict) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_batch([(date, record)])
+            return
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._drain(self._queue))
+        self._queue.put_nowait((date, record))
+
+    async def flush(self) -> None:
+        """Write everything queued so far; used on shutdown."""
+        queue = self._queue
+        if queue is None or self._loop is not asyncio.get_running_loop():
+            return
+        # Waits for the drain task too, including a batch it has already taken off the queue.
+        await queue.join()
+
+    def close(self) -> None:
+        """Stop the drain task and release the file handle; later records reopen it on demand."""
+        if self._task is not None:
+            self._task.cancel()
+        self._loop = self._queue = self._task = None
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+                self._date = ""
+
+    async def _drain(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_delay_sec
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Serialization and disk I/O stay off the event loop.
+            await asyncio.to_thread(self._write_batch, batch)
+            for _ in batch:
+                queue.task_done()
+
+    def _write_batch(self, batch: list[tuple[str, dict]]) -> None:
+        with self._lock:
+            try:
+                # Batches almost always share one date; hand each same-date run to writelines once.
+                run_date, lines = batch[0][0], []
+                for date, record in batch:
+                    if date != run_date:
+                        self._handle(run_date).writelines(lines)
+                        run_date, lines = date, []
+                    lines.append(_json_dumpb(record) + b"\n")
+                self._handle(run_date).writelines(lines)
+                self._fh.flush()
+            except Exception as e:
+                logger.warning(f"Failed to write AI log: {e}")
+
+    def _handle(self, date: str):
+        if self._fh is None or date != self._date:
+            if self._fh is not None:
+                self._fh.close()
+            if not self._dir_ready:
+                # Created on first write rather than at import, and only once per process.
+                os.makedirs(LOG_DIR, exist_ok=True)
+                self._dir_ready = True
+            self._fh = open(os.path.join(LOG_DIR, f"ai_{date}.jsonl"), "ab", buffering=1 << 16)
+            self._date = date
+        return self._fh
+
+
+_LOG_WRITER = _LogWriter()
+
+
+_custom_client = None
+_HTTPX_MAX_CONN = int(os.getenv("NEXAR_HTTPX_MAX_CONN", "500"))
+_HTTPX_MAX_KEEPALIVE = int(os.getenv("NEXAR_HTTPX_MAX_KEEPALIVE", "200"))
+# SDK clients keyed by their connection settings; each owns a pooled HTTP client.
+_sdk_clients: dict[tuple, object] = {}
+
+
+def _get_custom_client():
+    """Shared client for the custom provider so keep-alive connections survive across calls.
+
+    No lock needed: creation has no await, so two coroutines cannot interleave here.
+    """
+    global _custom_client
+    if _custom_client is None or _custom_client.is_closed:
+        _custom_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(120.0, connect=10.0),
+            http2=_HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_keepalive_connections=_HTTPX_MAX_KEEPALIVE,
+                max_connections=_HTTPX_MAX_CONN,
+            ),
+        )
+    return _custom_client
+
+
+def _get_openai_client(api_key: str, base_url: str, headers: dict[str, str]):
+    key = ("openai", api_key, base_url, tuple(sorted(headers.items())))
+    client = _sdk_clients.get(key)
+    if client is None:
+        client = _sdk_clients[key] = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, default_headers=headers)
+    return client
+
+
+def _get_anthropic_client(api_key: str):
+    key = ("anthropic", api_key)
+    client = _sdk_clients.get(key)
+    if client is None:
+        client = _sdk_clients[key] = anthropic.AsyncAnthropic(api_key=api_key)
+    return client
+
+
+async def shutdown() -> None:
+    global _custom_client
+    if _custom_client is not None:
+        await _custom_client.aclose()
+        _custom_client = None
+    clients = list(_sdk_clients.values())
+    _sdk_clients.clear()
+    for client in clients:
+        await client.close()
+    if _SEMANTIC_CACHE is not None:
+        await asyncio.to_thread(_SEMANTIC_CACHE.save)
+    await _LOG_WRITER.flush()
+    _LOG_WRITER.close()
+
+
+_LOG_CONTENT_MAX_CHARS = 4096
+# (date ordinal, "YYYY-MM-DD") of the last logged record; the string is rebuilt only on rollover.
+_log_day: tuple[int, str] = (0, "")
+_logged_prompt_day = ""
+_logged_prompt_digests: set[str] = set()
+
+
+def _compact_prompt_messages(messages: list[dict], today: str) -> list[dict]:
+    """日志用的精简消息：超长内容截断，同一天内重复的 system prompt 只记录摘要引用。"""
+    global _logged_prompt_day
+    if today != _logged_prompt_day:
+        _logged_prompt_day = today
+        _logged_prompt_digests.clear()
+
+    compact = []
+    for msg in messages:
+        content = msg.get("content") if isinstance(msg, dict) else None
+        if not isinstance(content, str):
+            compact.append(msg)
+            continue
+        if msg.get("role") == "system":
+            digest = hashlib.blake2b(content.encode("utf-8"), digest_size=8).hexdigest()
+            if digest in _logged_prompt_digests:
+                compact.append({"role": "system", "content_ref": digest})
+            else:
+                _logged_prompt_digests.add(digest)
+                compact.append({**msg, "content_digest": digest})
+            continue
+        if len(content) > _LOG_CONTENT_MAX_CHARS:
+            dropped = len(content) - _LOG_CONTENT_MAX_CHARS
+            compact.append({**msg, "content": f"{content[:_LOG_CONTENT_MAX_CHARS]}...<truncated {dropped} chars>"})
+        else:
+            compact.append(msg)
+    return compact
+
+
 def _log_interaction(
     provider: str,
     model: str,
@@ -75,25 +315,28 @@ def _log_interaction(
     llm_call: dict | None = None,
 ):
     """将每次 AI 请求和响应写入日志文件（按日期分文件）。"""
-    today = datetime.now().strftime("%Y-%m-%d")
-    log_file = os.path.join(LOG_DIR, f"ai_{today}.jsonl")
+    global _log_day
+    now = datetime.now()
+    if now.toordinal() != _log_day[0]:
+        _log_day = (now.toordinal(), now.date().isoformat())
+    today = _log_day[1]
+    # 出错时保留完整 prompt 便于排查；成功请求只记录精简版本。
+    prompt_messages = messages if error else _compact_prompt_messages(messages, today)
+    if llm_call is not None and "prompt_messages" in llm_call:
+        # 记录顶层已有 prompt_messages，日志里的 llm_call 不再重复一份。
+        llm_call = {k: v for k, v in llm_call.items() if k != "prompt_messages"}
 
     record = {
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": now.isoformat(),
         "provider": provider,
         "model": model,
         "elapsed_ms": elapsed_ms,
-        "prompt_messages": messages,
+        "prompt_messages": prompt_messages,
         "response": response if not error else None,
         "error": error,
         "llm_call": llm_call,
     }
-
-    try:
-        with open(log_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
-    except Exception as e:
-        logger.warning(f"Failed to write AI log: {e}")
+    _LOG_WRITER.submit(today, record)
 
     if error:
         logger.error(f"[{provider}/{model}] error={error} elapsed={elapsed_ms}ms")
@@ -210,14 +453,65 @@ PLANNER_SYSTEM_PROMPT = """你是 Nexar 的动作规划器（Planner）。
 }
 """
 
+# Built once; provider callers only read message dicts, so every request can share them.
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+_PLANNER_SYSTEM_MSG = {"role": "system", "content": PLANNER_SYSTEM_PROMPT}
+
+
+_JSON_FENCE_RE = re.compile(r"```json\s*\n?(.*?)\n?\s*```", re.DOTALL)
+# String literals are consumed whole so braces inside them never affect nesting depth.
+_BRACE_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|[{}]', re.DOTALL)
+
+
+def _line_bounds(content: str, start_line: int, end_line: int) -> tuple[int, int]:
+    """Return [start, end) char offsets of lines start_line..end_line (1-based, line breaks included)."""
+    offsets = line_offsets(content)
+    line_count = len(offsets) - 1
+    if end_line > line_count:
+        raise ValueError(f"Invalid range: file has {line_count} lines, but range_end={end_line}")
+    return offsets[start_line - 1], offsets[end_line]
+
 
 def _slice_lines(content: str, start_line: int, end_line: int) -> str:
-    lines = content.splitlines()
     if start_line < 1 or end_line < start_line:
         raise ValueError("Invalid range: range_start/range_end must satisfy 1 <= range_start <= range_end")
-    if end_line > len(lines):
-        raise ValueError(f"Invalid range: file has {len(lines)} lines, but range_end={end_line}")
-    return "\n".join(lines[start_line - 1:end_line])
+    start, end = _line_bounds(content, start_line, end_line)
+    # Only the selected lines are split; line breaks come back as "\n" like splitlines + join.
+    return "\n".join(content[start:end].splitlines())
+
+
+# Character budget for file/snippet context inlined into prompts; 0 disables trimming.
+_CTX_BUDGET_CHARS = int(os.getenv("NEXAR_CTX_BUDGET_CHARS", "12000"))
+_CTX_RANGE_MARGIN_LINES = 80
+
+
+def _fit_context(
+    code: str,
+    range_start: int | None = None,
+    range_end: int | None = None,
+    budget_chars: int = _CTX_BUDGET_CHARS,
+) -> str:
+    """Trim code to the budget: a window around the range if given, otherwise head + tail."""
+    if budget_chars <= 0 or len(code) <= budget_chars:
+        return code
+    line_count = len(line_offsets(code)) - 1 if range_start is not None and range_end is not None else 0
+    if line_count and 1 <= range_start <= range_end <= line_count:
+        lo = max(1, range_start - _CTX_RANGE_MARGIN_LINES)
+        hi = min(line_count, range_end + _CTX_RANGE_MARGIN_LINES)
+        parts = []
+        if lo > 1:
+            parts.append(f"[... 省略第 1-{lo - 1} 行 ...]\n")
+        parts.append(_slice_lines(code, lo, hi))
+        if hi < line_count:
+            parts.append(f"\n[... 省略第 {hi + 1}-{line_count} 行 ...]")
+        return "".join(parts)
+    # Cut on line boundaries so the model never sees half a line.
+    head_end = code.rfind("\n", 0, budget_chars * 2 // 3)
+    tail_start = code.find("\n", len(code) - budget_chars // 3) + 1
+    if head_end <= 0 or tail_start <= head_end:
+        return code[:budget_chars]
+    elided = code.count("\n", head_end + 1, tail_start)
+    return f"{code[:head_end]}\n[... 省略 {elided} 行 ...]\n{code[tail_start:]}"
 
 
 def _build_messages(
@@ -231,25 +525,37 @@ def _build_messages(
     planning_mode: bool = False,
     range_start: int | None = None,
     range_end: int | None = None,
+    latest_user_text: str | None = None,
 ) -> list[dict]:
     if action == "modify" and ((range_start is None) != (range_end is None)):
         raise ValueError("range_start and range_end must be provided together")
 
-    built = [{"role": "system", "content": SYSTEM_PROMPT}]
+    # Plain chat with no file, snippets or mode hints adds no context: pass the turns straight through.
+    if action == "chat" and not current_file and not snippets and not chat_only and not planning_mode:
+        return [_SYSTEM_MSG] + [
+            {"role": msg.role, "content": msg.content} for msg in messages
+        ]
 
+    built = [_SYSTEM_MSG]
+
+    # Collect context pieces and join once; current_code and snippets can be large.
+    context_parts: list[str] = []
     if current_file and current_code:
-        context = f"\n\n[当前打开的文件: {current_file}]\n```\n{current_code}\n```"
-    else:
-        context = ""
+        # A whole-file modify must see the whole file; every other action gets a trimmed view.
+        if action == "modify" and range_start is None:
+            code_view = current_code
+        else:
+            code_view = _fit_context(current_code, range_start, range_end)
+        context_parts.append(f"\n\n[当前打开的文件: {current_file}]\n```\n{code_view}\n```")
 
     if action == "generate" and file_path:
-        context += f"\n\n[用户要求生成文件: {file_path}，请以JSON格式返回结果]"
+        context_parts.append(f"\n\n[用户要求生成文件: {file_path}，请以JSON格式返回结果]")
     elif action == "modify" and current_file:
         if range_start is not None and range_end is not None:
             if not current_code:
                 raise ValueError("Range modify requires current_code")
             selected = _slice_lines(current_code, range_start, range_end)
-            context += (
+            context_parts.append(
                 f"\n\n[用户要求范围修改文件: {current_file}]"
                 f"\n[仅修改第 {range_start}-{range_end} 行]"
                 "\n[请保持范围外代码不变]"
@@ -257,47 +563,60 @@ def _build_messages(
                 f"\n[当前范围原始代码]\n```\n{selected}\n```"
             )
         else:
-            context += f"\n\n[用户要求修改文件: {current_file}，请以JSON格式返回修改后的完整文件]"
+            context_parts.append(f"\n\n[用户要求修改文件: {current_file}，请以JSON格式返回修改后的完整文件]")
 
     if chat_only:
-        context += (
+        context_parts.append(
             "\n\n[当前请求为仅对话模式]"
             "\n[你必须只返回自然语言回答，不得返回可落盘的文件修改结果]"
             "\n[不要返回 action=modify/generate 的 JSON 结构]"
         )
     if planning_mode:
-        context += (
+        context_parts.append(
             "\n\n[当前请求为 planning 模式]"
             "\n[你必须只输出规划结果，action 必须为 plan]"
             "\n[不得返回可落盘的文件修改结果]"
             "\n[steps 中的 status 统一先用 pending]"
         )
 
-    snippet_focused = _is_snippet_focused_intent(messages) if snippets else False
+    if snippets and latest_user_text is None:
+        latest_user_text = _latest_user_text(messages)
+    snippet_focused = _is_snippet_focused_intent(latest_user_text) if snippets else False
 
     if snippets:
-        context += "\n\n[用户粘贴的代码片段引用如下，可作为参考上下文]"
-        for idx, snippet in enumerate(snippets, start=1):
-            context += (
-                f"\n\n[片段{idx}: {snippet.file_path} ({snippet.start_line}-{snippet.end_line})]"
-                f"\n```\n{snippet.content}\n```"
-            )
+        # Snippets that are themselves the edit target are sent whole: the model must never
+        # rewrite code it was only shown with elided middles. Only reference snippets are trimmed.
+        snippets_are_target = action in ("modify", "generate") and (not current_file or snippet_focused)
+        if snippets_are_target:
+            total_chars = sum(len(snippet.content) for snippet in snippets)
+            if 0 < _CTX_BUDGET_CHARS < total_chars:
+                logger.warning(
+                    f"Edit-target snippets exceed the context budget ({total_chars} > {_CTX_BUDGET_CHARS} chars); sending them untrimmed"
+                )
+        context_parts.append("\n\n[用户粘贴的代码片段引用如下，可作为参考上下文]")
+        context_parts.extend(
+            f"\n\n[片段{idx}: {snippet.file_path} ({snippet.start_line}-{snippet.end_line})]"
+            f"\n```\n{snippet.content if snippets_are_target else _fit_context(snippet.content)}\n```"
+            for idx, snippet in enumerate(snippets, start=1)
+        )
         if snippet_focused:
-            context += (
+            context_parts.append(
                 "\n\n[用户明确要求修改“这部分/这些片段”，请优先修改引用片段范围；"
                 "若确有必要可做最小范围的关联调整]"
             )
         else:
-            context += (
+            context_parts.append(
                 "\n\n[用户未明确要求只改引用片段：这些片段仅用于理解上下文，"
                 "你应根据用户意图自行判断修改范围，或仅回答问题]"
             )
 
-    for msg in messages:
-        content = msg.content
-        if msg.role == "user" and msg == messages[-1]:
-            content += context
-        built.append({"role": msg.role, "content": content})
+    context = "".join(context_parts)
+
+    # Earlier turns pass through unchanged; only a trailing user turn carries the context.
+    built.extend({"role": msg.role, "content": msg.content} for msg in messages[:-1])
+    if messages:
+        last = messages[-1]
+        built.append({"role": last.role, "content": last.content + context if last.role == "user" else last.content})
 
     return built
 
@@ -309,30 +628,41 @@ def _latest_user_text(messages: list[ChatMessage]) -> str:
     return ""
 
 
-def _is_snippet_focused_intent(messages: list[ChatMessage]) -> bool:
-    text = _latest_user_text(messages)
-    focus_terms = (
-        "这部分", "这段", "这些片段", "引用部分", "选中部分",
-        "this part", "these parts", "selected snippet", "selected part",
-    )
-    edit_terms = (
-        "改", "修改", "重构", "优化", "修复", "调整",
-        "modify", "change", "edit", "refactor", "optimize", "fix", "rewrite",
-    )
-    return any(t in text for t in focus_terms) and any(t in text for t in edit_terms)
+def _alternatives(terms: tuple[str, ...]) -> str:
+    return "|".join(re.escape(t) for t in terms)
 
 
-def _has_modify_intent(messages: list[ChatMessage]) -> bool:
-    text = _latest_user_text(messages)
-    modify_hints = (
-        "modify", "change", "edit", "refactor", "rewrite", "fix", "optimize",
-        "修改", "重构", "优化", "修复", "调整", "改一下", "改成",
-    )
-    return any(word in text for word in modify_hints)
+_FOCUS_TERMS = (
+    "这部分", "这段", "这些片段", "引用部分", "选中部分",
+    "this part", "these parts", "selected snippet", "selected part",
+)
+_EDIT_TERMS = (
+    "改", "修改", "重构", "优化", "修复", "调整",
+    "modify", "change", "edit", "refactor", "optimize", "fix", "rewrite",
+)
+# One tagged alternation: a single sweep reports which term set each hit belongs to.
+_FOCUS_EDIT_RE = re.compile(f"(?P<focus>{_alternatives(_FOCUS_TERMS)})|(?P<edit>{_alternatives(_EDIT_TERMS)})")
+_MODIFY_HINTS_RE = re.compile(_alternatives((
+    "modify", "change", "edit", "refactor", "rewrite", "fix", "optimize",
+    "修改", "重构", "优化", "修复", "调整", "改一下", "改成",
+)))
+
+
+def _is_snippet_focused_intent(text: str) -> bool:
+    seen = set()
+    for m in _FOCUS_EDIT_RE.finditer(text):
+        seen.add(m.lastgroup)
+        if len(seen) == 2:
+            return True
+    return False
+
+
+def _has_modify_intent(text: str) -> bool:
+    return _MODIFY_HINTS_RE.search(text) is not None
 
 
 def _infer_action(
-    messages: list[ChatMessage],
+    latest_user_text: str,
     current_file: str | None,
     file_path: str | None,
     snippets: list[CodeSnippet] | None,
@@ -353,79 +683,120 @@ def _infer_action(
     if range_start is not None or range_end is not None:
         return "modify"
 
-    if snippets and _has_modify_intent(messages):
-        return "modify"
-
-    if current_file and _has_modify_intent(messages):
+    if (snippets or current_file) and _has_modify_intent(latest_user_text):
         return "modify"
 
     return "chat"
 
 
+def _find_json_object(raw: str, required_key: str | None = None) -> dict | None:
+    """Return the first JSON object embedded in raw, optionally one that has required_key.
+
+    One pass pairs up braces (skipping string literals inside them); only outermost balanced
+    spans are decoded, so a stray "{" in surrounding prose does not hide the payload.
+    """
+    opens: list[int] = []
+    # spans[i] collects the closed top-level spans directly under opens[i - 1]; spans[0] is the root.
+    spans: list[list[tuple[int, int]]] = [[]]
+    pos = raw.find("{")
+    while pos != -1:
+        if not opens:
+            pos = raw.find("{", pos)
+            if pos == -1:
+                break
+            opens.append(pos)
+            spans.append([])
+            pos += 1
+            continue
+        m = _BRACE_TOKEN_RE.search(raw, pos)
+        if m is None:
+            break
+        pos = m.end()
+        tok = m.group()
+        if tok == "{":
+            opens.append(m.start())
+            spans.append([])
+        elif tok == "}":
+            start = opens.pop()
+            spans.pop()
+            spans[-1].append((start, pos))
+
+    for start, end in sorted(span for level in spans for span in level):
+        try:
+            obj = _json_loads(raw[start:end])
+        except ValueError:
+            continue
+        if isinstance(obj, dict) and (required_key is None or required_key in obj):
+            return obj
+    return None
+
+
+def _json_to_ai_response(data: dict, raw: str, action: str) -> AIResponse:
+    plan_data = data.get("plan")
+    plan = None
+    if isinstance(plan_data, dict):
+        steps_data = plan_data.get("steps", [])
+        steps: list[PlanStep] = []
+        if isinstance(steps_data, list):
+            for step in steps_data:
+                if isinstance(step, dict) and step.get("title"):
+                    steps.append(
+                        PlanStep(
+                            title=str(step.get("title")),
+                            detail=step.get("detail"),
+                            status=str(step.get("status", "pending")),
+                            acceptance=step.get("acceptance"),
+                        )
+                    )
+        plan = PlanBlock(
+            summary=str(plan_data.get("summary", "")),
+            milestones=[str(x) for x in plan_data.get("milestones", []) if isinstance(x, (str, int, float))],
+            steps=steps,
+            risks=[str(x) for x in plan_data.get("risks", []) if isinstance(x, (str, int, float))],
+        )
+    changes_data = data.get("changes")
+    changes = None
+    if isinstance(changes_data, list):
+        parsed_changes: list[FileChange] = []
+        for item in changes_data:
+            if isinstance(item, dict) and item.get("file_path") and item.get("file_content") is not None:
+                parsed_changes.append(
+                    FileChange(
+                        file_path=str(item.get("file_path")),
+                        file_content=str(item.get("file_content")),
+                    )
+                )
+        if parsed_changes:
+            changes = parsed_changes
+
+    return AIResponse(
+        content=data.get("explanation", raw),
+        file_path=data.get("file_path"),
+        file_content=data.get("file_content"),
+        action=data.get("action", action),
+        plan=plan,
+        changes=changes,
+    )
+
+
 def _parse_ai_response(raw: str, action: str) -> AIResponse:
-    json_match = re.search(r'```json\s*\n?(.*?)\n?\s*```', raw, re.DOTALL)
-    if not json_match:
-        json_match = re.search(r'\{[\s\S]*"action"[\s\S]*\}', raw, re.DOTALL)
+    fence = _JSON_FENCE_RE.search(raw)
+    inline = None if fence else _find_json_object(raw, "action")
 
-    if json_match:
+    if fence or inline is not None:
         try:
-            text = json_match.group(1) if '```' in json_match.group(0) else json_match.group(0)
-            data = json.loads(text)
-            plan_data = data.get("plan")
-            plan = None
-            if isinstance(plan_data, dict):
-                steps_data = plan_data.get("steps", [])
-                steps: list[PlanStep] = []
-                if isinstance(steps_data, list):
-                    for step in steps_data:
-                        if isinstance(step, dict) and step.get("title"):
-                            steps.append(
-                                PlanStep(
-                                    title=str(step.get("title")),
-                                    detail=step.get("detail"),
-                                    status=str(step.get("status", "pending")),
-                                    acceptance=step.get("acceptance"),
-                                )
-                            )
-                plan = PlanBlock(
-                    summary=str(plan_data.get("summary", "")),
-                    milestones=[str(x) for x in plan_data.get("milestones", []) if isinstance(x, (str, int, float))],
-                    steps=steps,
-                    risks=[str(x) for x in plan_data.get("risks", []) if isinstance(x, (str, int, float))],
-                )
-            changes_data = data.get("changes")
-            changes = None
-            if isinstance(changes_data, list):
-                parsed_changes: list[FileChange] = []
-                for item in changes_data:
-                    if isinstance(item, dict) and item.get("file_path") and item.get("file_content") is not None:
-                        parsed_changes.append(
-                            FileChange(
-                                file_path=str(item.get("file_path")),
-                                file_content=str(item.get("file_content")),
-                            )
-                        )
-                if parsed_changes:
-                    changes = parsed_changes
-
-            return AIResponse(
-                content=data.get("explanation", raw),
-                file_path=data.get("file_path"),
-                file_content=data.get("file_content"),
-                action=data.get("action", action),
-                plan=plan,
-                changes=changes,
-            )
+            data = _json_loads(fence.group(1)) if fence else inline
+            return _json_to_ai_response(data, raw, action)
         except (json.JSONDecodeError, AttributeError):
             pass
 
     stripped = raw.strip()
     if stripped.startswith("{") and stripped.endswith("}"):
         try:
-            data = json.loads(stripped)
+            data = _json_loads(stripped)
             if isinstance(data, dict) and "action" in data:
-                return _parse_ai_response(f"```json\n{stripped}\n```", action)
-        except json.JSONDecodeError:
+                return _json_to_ai_response(data, raw, action)
+        except (json.JSONDecodeError, AttributeError):
             pass
 
     fallback_action = "plan" if action == "plan" else "chat"
@@ -433,18 +804,14 @@ def _parse_ai_response(raw: str, action: str) -> AIResponse:
 
 
 def _extract_json_payload(raw: str) -> dict:
-    json_match = re.search(r'```json\s*\n?(.*?)\n?\s*```', raw, re.DOTALL)
+    json_match = _JSON_FENCE_RE.search(raw)
     if json_match:
-        return json.loads(json_match.group(1))
+        return _json_loads(json_match.group(1))
 
-    text = raw.strip()
-    if text.startswith("{") and text.endswith("}"):
-        return json.loads(text)
-
-    obj_match = re.search(r"\{[\s\S]*\}", raw, re.DOTALL)
-    if obj_match:
-        return json.loads(obj_match.group(0))
-    raise ValueError("planner output is not valid JSON")
+    payload = _find_json_object(raw)
+    if payload is None:
+        raise ValueError("planner output is not valid JSON")
+    return payload
 
 
 def _parse_action_batch_response(raw: str, iteration: int) -> ActionBatch:
@@ -458,26 +825,105 @@ def _build_history_summary(messages: list[ChatMessage], max_chars: int) -> str:
     if not messages:
         return ""
     parts: list[str] = []
-    total = 0
+    remaining = max_chars
     for msg in messages:
-        content = (msg.content or "").replace("\n", " ").strip()
+        content = msg.content or ""
+        if "\n" in content:
+            content = content.replace("\n", " ")
+        content = content.strip()
         if not content:
             continue
         entry = f"{msg.role}: {content}"
-        if total + len(entry) + (1 if parts else 0) > max_chars:
-            remain = max_chars - total - (1 if parts else 0)
-            if remain > 20:
-                entry = entry[:remain]
-                parts.append(entry)
+        if parts:
+            remaining -= 1  # "\n" separator
+        if len(entry) > remaining:
+            if remaining > 20:
+                parts.append(entry[:remaining])
             break
         parts.append(entry)
-        total += len(entry) + (1 if parts else 0)
+        remaining -= len(entry)
     return "\n".join(parts)
 
 
-async def call_openai(messages: list[dict]) -> tuple[str, dict]:
-    import openai
-    import time
+_OPENROUTER_AUTH_ERROR = (
+    "OpenRouter API 认证失败 (401): API Key 无效、已过期或账户不存在。\n\n"
+    "请检查以下事项：\n"
+    "1. 访问 https://openrouter.ai/keys 确认 API Key 是否有效\n"
+    "2. 检查 backend/.env 中的 {key_env} 是否正确（应以 sk-or-v1- 开头）\n"
+    "3. 确认 OpenRouter 账户是否已激活\n"
+    "4. 检查 API Key 是否有足够的余额\n"
+    "5. 当前使用的 API Key 前缀: {key_prefix}..."
+)
+
+
+def _is_auth_error_text(text: str) -> bool:
+    return "User not found" in text or "401" in text or "unauthorized" in text.lower()
+
+
+def _openrouter_auth_error_msg(api_key: str, key_env: str = "OPENAI_API_KEY") -> str:
+    return _OPENROUTER_AUTH_ERROR.format_map({"key_prefix": api_key[:10], "key_env": key_env})
+
+
+# provider -> (generic error prefix, env var holding its API key)
+_PROVIDER_ERROR_INFO = {
+    "openai": ("调用 OpenAI API 时发生错误", "OPENAI_API_KEY"),
+    "claude": ("调用 Claude API 时发生错误", "ANTHROPIC_API_KEY"),
+    "custom": ("调用自定义 API 时发生错误", "CUSTOM_API_KEY"),
+}
+
+
+def _is_auth_status(e: Exception) -> bool:
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    return status == 401
+
+
+def _normalize_llm_error(e: Exception, provider: str, base_url: str = "", api_key: str = "") -> str:
+    """User-facing message for an unexpected provider error; auth failures get setup hints.
+
+    Auth is detected from the HTTP status. The message-text heuristic only applies to the OpenAI
+    client, which is also what talks to OpenRouter.
+    """
+    prefix, key_env = _PROVIDER_ERROR_INFO[provider]
+    text = str(e)
+    if not (_is_auth_status(e) or (provider == "openai" and _is_auth_error_text(text))):
+        return f"{prefix}: {text}"
+    if provider == "openai" and "openrouter.ai" in base_url:
+        return _openrouter_auth_error_msg(api_key, key_env)
+    return f"API 认证失败: API Key 无效或已过期。请检查 backend/.env 中的 {key_env} 配置"
+
+
+# Sampling parameters shared by every provider call; part of the response cache key.
+_LLM_TEMPERATURE = 0.3
+_LLM_MAX_TOKENS = 8192
+
+
+async def _stream_openai_chat(client, model: str, messages: list[dict], on_token: TokenCallback):
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=_LLM_TEMPERATURE,
+        max_tokens=_LLM_MAX_TOKENS,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    parts: list[str] = []
+    usage = None
+    async for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage
+        if chunk.choices:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                await on_token(delta)
+    return "".join(parts), usage
+
+
+async def call_openai(messages: list[dict], on_token: TokenCallback | None = None) -> tuple[str, dict]:
+    if openai is None:
+        raise ValueError("openai 未安装，请先执行 pip install -r backend/requirements.txt")
     base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
     model = os.getenv("OPENAI_MODEL", "gpt-4o")
     api_key = os.getenv("OPENAI_API_KEY", "")
@@ -496,17 +942,16 @@ async def call_openai(messages: list[dict]) -> tuple[str, dict]:
         if not api_key.startswith("sk-or-v1-") and not api_key.startswith("sk-or-"):
             logger.warning(f"OpenRouter API Key 格式可能不正确，应以 'sk-or-v1-' 或 'sk-or-' 开头")
     
-    client = openai.AsyncOpenAI(
-        api_key=api_key,
-        base_url=base_url,
-        default_headers=extra_headers,
-    )
+    client = _get_openai_client(api_key, base_url, extra_headers)
     t0 = time.monotonic()
     try:
-        resp = await client.chat.completions.create(model=model, messages=messages, temperature=0.3, max_tokens=8192)
-        result = resp.choices[0].message.content or ""
+        if on_token is None:
+            resp = await client.chat.completions.create(model=model, messages=messages, temperature=_LLM_TEMPERATURE, max_tokens=_LLM_MAX_TOKENS)
+            result = resp.choices[0].message.content or ""
+            usage = getattr(resp, "usage", None)
+        else:
+            result, usage = await _stream_openai_chat(client, model, messages, on_token)
         elapsed_ms = int((time.monotonic() - t0) * 1000)
-        usage = getattr(resp, "usage", None)
         input_tokens = getattr(usage, "prompt_tokens", None) if usage is not None else None
         output_tokens = getattr(usage, "completion_tokens", None) if usage is not None else None
         llm_call = _build_llm_call_meta(
@@ -543,21 +988,12 @@ async def call_openai(messages: list[dict]) -> tuple[str, dict]:
         else:
             error_message = error_detail
             
-        if "User not found" in error_message or "401" in error_message or "unauthorized" in error_message.lower():
-            if "openrouter.ai" in base_url:
-                error_msg = (
-                    "OpenRouter API 认证失败 (401): API Key 无效、已过期或账户不存在。\n\n"
-                    "请检查以下事项：\n"
-                    "1. 访问 https://openrouter.ai/keys 确认 API Key 是否有效\n"
-                    "2. 检查 backend/.env 中的 OPENAI_API_KEY 是否正确（应以 sk-or-v1- 开头）\n"
-                    "3. 确认 OpenRouter 账户是否已激活\n"
-                    "4. 检查 API Key 是否有足够的余额\n"
-                    f"5. 当前使用的 API Key 前缀: {api_key[:10]}..."
-                )
-            else:
-                error_msg = f"OpenAI API 认证失败: {error_message}。请检查 backend/.env 中的 OPENAI_API_KEY 配置"
-        else:
+        if not _is_auth_error_text(error_message):
             error_msg = f"API 认证失败: {error_message}。请检查 backend/.env 中的 OPENAI_API_KEY 配置"
+        elif "openrouter.ai" in base_url:
+            error_msg = _openrouter_auth_error_msg(api_key)
+        else:
+            error_msg = f"OpenAI API 认证失败: {error_message}。请检查 backend/.env 中的 OPENAI_API_KEY 配置"
         _log_interaction("openai", model, messages, "", int((time.monotonic() - t0) * 1000), error=error_msg)
         raise ValueError(error_msg) from e
     except openai.APIError as e:
@@ -565,36 +1001,21 @@ async def call_openai(messages: list[dict]) -> tuple[str, dict]:
         _log_interaction("openai", model, messages, "", int((time.monotonic() - t0) * 1000), error=error_msg)
         raise ValueError(error_msg) from e
     except Exception as e:
-        error_str = str(e)
-        if "User not found" in error_str or "401" in error_str or "unauthorized" in error_str.lower():
-            if "openrouter.ai" in base_url:
-                error_msg = (
-                    "OpenRouter API 认证失败 (401): API Key 无效、已过期或账户不存在。\n\n"
-                    "请检查以下事项：\n"
-                    "1. 访问 https://openrouter.ai/keys 确认 API Key 是否有效\n"
-                    "2. 检查 backend/.env 中的 OPENAI_API_KEY 是否正确（应以 sk-or-v1- 开头）\n"
-                    "3. 确认 OpenRouter 账户是否已激活\n"
-                    "4. 检查 API Key 是否有足够的余额\n"
-                    f"5. 当前使用的 API Key 前缀: {api_key[:10]}..."
-                )
-            else:
-                error_msg = "API 认证失败: API Key 无效或已过期。请检查 backend/.env 中的 OPENAI_API_KEY 配置"
-        else:
-            error_msg = f"调用 OpenAI API 时发生错误: {error_str}"
+        error_msg = _normalize_llm_error(e, "openai", base_url, api_key)
         _log_interaction("openai", model, messages, "", int((time.monotonic() - t0) * 1000), error=error_msg)
         raise ValueError(error_msg) from e
 
 
-async def call_claude(messages: list[dict]) -> tuple[str, dict]:
-    import anthropic
-    import time
+async def call_claude(messages: list[dict], on_token: TokenCallback | None = None) -> tuple[str, dict]:
+    if anthropic is None:
+        raise ValueError("anthropic 未安装，请先执行 pip install -r backend/requirements.txt")
     api_key = os.getenv("ANTHROPIC_API_KEY", "")
     model = os.getenv("ANTHROPIC_MODEL", "claude-sonnet-4-20250514")
     
     if not api_key:
         raise ValueError("ANTHROPIC_API_KEY 未配置，请在 backend/.env 文件中设置")
     
-    client = anthropic.AsyncAnthropic(api_key=api_key)
+    client = _get_anthropic_client(api_key)
 
     system_msg = ""
     api_messages = []
@@ -604,15 +1025,41 @@ async def call_claude(messages: list[dict]) -> tuple[str, dict]:
         else:
             api_messages.append(m)
 
+    # The system prompt is identical across calls; mark it as a cache breakpoint so the
+    # provider can serve that prefix from its prompt cache.
+    system = [{"type": "text", "text": system_msg, "cache_control": {"type": "ephemeral"}}] if system_msg else ""
+    # Earlier turns are also byte-stable (only the final user turn carries file context), so a
+    # second breakpoint at the end of the history lets follow-up turns reuse it as well.
+    if len(api_messages) >= 2 and isinstance(api_messages[-2]["content"], str) and api_messages[-2]["content"]:
+        prev = api_messages[-2]
+        api_messages[-2] = {
+            "role": prev["role"],
+            "content": [{"type": "text", "text": prev["content"], "cache_control": {"type": "ephemeral"}}],
+        }
+
     t0 = time.monotonic()
     try:
-        resp = await client.messages.create(
-            model=model, max_tokens=8192, system=system_msg, messages=api_messages, temperature=0.3
-        )
+        if on_token is None:
+            resp = await client.messages.create(
+                model=model, max_tokens=_LLM_MAX_TOKENS, system=system, messages=api_messages, temperature=_LLM_TEMPERATURE
+            )
+        else:
+            async with client.messages.stream(
+                model=model, max_tokens=_LLM_MAX_TOKENS, system=system, messages=api_messages, temperature=_LLM_TEMPERATURE
+            ) as stream:
+                async for text in stream.text_stream:
+                    await on_token(text)
+                resp = await stream.get_final_message()
         result = resp.content[0].text
         elapsed_ms = int((time.monotonic() - t0) * 1000)
         usage = getattr(resp, "usage", None)
         input_tokens = getattr(usage, "input_tokens", None) if usage is not None else None
+        if isinstance(input_tokens, int):
+            # input_tokens excludes prompt-cache reads/writes; add them back for the full prompt size.
+            for cache_field in ("cache_creation_input_tokens", "cache_read_input_tokens"):
+                cached_tokens = getattr(usage, cache_field, None)
+                if isinstance(cached_tokens, int):
+                    input_tokens += cached_tokens
         output_tokens = getattr(usage, "output_tokens", None) if usage is not None else None
         llm_call = _build_llm_call_meta(
             provider="claude",
@@ -634,15 +1081,43 @@ async def call_claude(messages: list[dict]) -> tuple[str, dict]:
         _log_interaction("claude", model, messages, "", int((time.monotonic() - t0) * 1000), error=error_msg)
         raise ValueError(error_msg) from e
     except Exception as e:
-        error_msg = f"调用 Claude API 时发生错误: {str(e)}"
+        error_msg = _normalize_llm_error(e, "claude")
         _log_interaction("claude", model, messages, "", int((time.monotonic() - t0) * 1000), error=error_msg)
         raise ValueError(error_msg) from e
 
 
-async def call_custom(messages: list[dict]) -> tuple[str, dict]:
+async def _stream_custom_chat(url: str, headers: dict, body: dict, on_token: TokenCallback):
+    """Read an OpenAI-compatible SSE stream, forwarding content deltas as they arrive."""
+    parts: list[str] = []
+    usage = None
+    async with _get_custom_client().stream("POST", url, headers=headers, content=_json_dumpb(body)) as resp:
+        if resp.is_error:
+            await resp.aread()
+            resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            if not data:
+                continue
+            chunk = _json_loads(data)
+            if not isinstance(chunk, dict):
+                continue
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    parts.append(delta)
+                    await on_token(delta)
+    return "".join(parts), usage
+
+
+async def call_custom(messages: list[dict], on_token: TokenCallback | None = None) -> tuple[str, dict]:
     """OpenAI-compatible custom endpoint."""
-    import httpx
-    import time
+    if httpx is None:
+        raise ValueError("httpx 未安装，请先执行 pip install -r backend/requirements.txt")
     base_url = os.getenv("CUSTOM_BASE_URL", "")
     api_key = os.getenv("CUSTOM_API_KEY", "")
     model = os.getenv("CUSTOM_MODEL", "")
@@ -658,17 +1133,22 @@ async def call_custom(messages: list[dict]) -> tuple[str, dict]:
 
     t0 = time.monotonic()
     try:
-        async with httpx.AsyncClient(timeout=120) as client:
-            resp = await client.post(
+        body = {"model": model, "messages": messages, "temperature": _LLM_TEMPERATURE, "max_tokens": _LLM_MAX_TOKENS}
+        if on_token is None:
+            resp = await _get_custom_client().post(
                 f"{base_url}/chat/completions",
                 headers=headers,
-                json={"model": model, "messages": messages, "temperature": 0.3, "max_tokens": 8192},
+                content=_json_dumpb(body),
             )
             resp.raise_for_status()
-            data = resp.json()
+            data = _json_loads(resp.content)
             result = data["choices"][0]["message"]["content"]
+            usage = data.get("usage", {}) if isinstance(data, dict) else {}
+        else:
+            body["stream"] = True
+            body["stream_options"] = {"include_usage": True}
+            result, usage = await _stream_custom_chat(f"{base_url}/chat/completions", headers, body, on_token)
         elapsed_ms = int((time.monotonic() - t0) * 1000)
-        usage = data.get("usage", {}) if isinstance(data, dict) else {}
         input_tokens = usage.get("prompt_tokens") if isinstance(usage, dict) else None
         output_tokens = usage.get("completion_tokens") if isinstance(usage, dict) else None
         llm_call = _build_llm_call_meta(
@@ -685,7 +1165,7 @@ async def call_custom(messages: list[dict]) -> tuple[str, dict]:
     except httpx.HTTPStatusError as e:
         status_code = e.response.status_code
         try:
-            error_data = e.response.json()
+            error_data = _json_loads(e.response.content)
             error_detail = error_data.get("error", {})
             if isinstance(error_detail, dict):
                 error_message = error_detail.get("message", str(e))
@@ -713,11 +1193,93 @@ async def call_custom(messages: list[dict]) -> tuple[str, dict]:
         _log_interaction("custom", model, messages, "", int((time.monotonic() - t0) * 1000), error=error_msg)
         raise ValueError(error_msg) from e
     except Exception as e:
-        error_msg = f"调用自定义 API 时发生错误: {str(e)}"
+        error_msg = _normalize_llm_error(e, "custom", base_url, api_key)
         _log_interaction("custom", model, messages, "", int((time.monotonic() - t0) * 1000), error=error_msg)
         raise ValueError(error_msg) from e
 
 
+_PROVIDER_CALLERS: dict[AIProvider, Callable[..., Awaitable[tuple[str, dict]]]] = {
+    AIProvider.OPENAI: call_openai,
+    AIProvider.CLAUDE: call_claude,
+    AIProvider.CUSTOM: call_custom,
+}
+
+_PROVIDER_MODEL_ENV = {
+    AIProvider.OPENAI: ("OPENAI_MODEL", "gpt-4o"),
+    AIProvider.CLAUDE: ("ANTHROPIC_MODEL", "claude-sonnet-4-20250514"),
+    AIProvider.CUSTOM: ("CUSTOM_MODEL", ""),
+}
+
+
+_PROVIDER_BASE_URL_ENV = {
+    AIProvider.OPENAI: ("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+    AIProvider.CLAUDE: ("ANTHROPIC_BASE_URL", ""),
+    AIProvider.CUSTOM: ("CUSTOM_BASE_URL", ""),
+}
+
+
+class _ResponseCache:
+    """LRU of LLM results keyed by (provider, model, base URL, digest of sampling params + prompt).
+
+    Pydantic values are deep-copied on the way in and out; other values are stored as given.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_sec: float | None = None):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._entries: OrderedDict[tuple[str, ...], tuple[float, object]] = OrderedDict()
+
+    @staticmethod
+    def _copy(value):
+        return value.model_copy(deep=True) if isinstance(value, BaseModel) else value
+
+    @staticmethod
+    def key(provider: AIProvider, payload: str) -> tuple[str, str, str, str]:
+        env_name, default = _PROVIDER_MODEL_ENV.get(provider, _PROVIDER_MODEL_ENV[AIProvider.OPENAI])
+        url_env, url_default = _PROVIDER_BASE_URL_ENV.get(provider, _PROVIDER_BASE_URL_ENV[AIProvider.OPENAI])
+        digest = hashlib.blake2b(
+            f"{_LLM_TEMPERATURE}|{_LLM_MAX_TOKENS}\n{payload}".encode("utf-8"), digest_size=16
+        ).hexdigest()
+        return provider.value, os.getenv(env_name, default), os.getenv(url_env, url_default), digest
+
+    def get(self, key: tuple[str, ...]):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if self.ttl_sec is not None and time.monotonic() - stored_at > self.ttl_sec:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return self._copy(value)
+
+    def put(self, key: tuple[str, ...], value) -> None:
+        self._entries[key] = (time.monotonic(), self._copy(value))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+# Only terminal planner decisions are replayed; anything that drives further actions is re-planned.
+_PLANNER_CACHEABLE_MODES = frozenset({"done", "ask_user"})
+_PLANNER_CACHE = _ResponseCache()
+# Raw (reply, llm_call) pairs for exact prompt repeats in chat(). Opt-in: set NEXAR_LLM_CACHE_TTL
+# (seconds) to enable it.
+_LLM_CACHE_TTL = float(os.getenv("NEXAR_LLM_CACHE_TTL", "0"))
+_LLM_CACHE = _ResponseCache(max_entries=1024, ttl_sec=_LLM_CACHE_TTL)
+
+_SEMANTIC_CACHE: SemanticCache | None = None
+if os.getenv("NEXAR_SEMANTIC_CACHE") == "1":
+    _semantic = SemanticCache(
+        threshold=float(os.getenv("NEXAR_SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        path=os.path.join(LOG_DIR, "semantic_cache.npz"),
+    )
+    if _semantic.available:
+        _SEMANTIC_CACHE = _semantic
+    else:
+        logger.warning("NEXAR_SEMANTIC_CACHE=1 but numpy/sentence-transformers are not installed; semantic cache disabled")
+
+
 async def plan_actions(
     provider: AIProvider,
     request: AIRequestSnapshot,
@@ -726,6 +1288,7 @@ async def plan_actions(
     action_history: list[ActionExecutionRecord],
     context_snapshot: dict,
     available_actions: list[str],
+    on_token: TokenCallback | None = None,
 ) -> ActionBatch:
     cfg = request.history_config
     turns = cfg.turns if cfg else 40
@@ -741,14 +1304,10 @@ async def plan_actions(
         text = msg.content or ""
         if len(text) > max_chars_per_message:
             text = text[:max_chars_per_message]
-        conversation_history.append(
-            {
-                "role": msg.role,
-                "content": text,
-            }
-        )
+        conversation_history.append({"role": msg.role, "content": text})
     conversation_summary = _build_history_summary(omitted_messages, max_chars=summary_max_chars) if summary_enabled else ""
 
+    recent_actions = action_history[-40:]
     history_payload = [
         {
             "iteration": rec.iteration,
@@ -759,9 +1318,12 @@ async def plan_actions(
             "error": rec.error,
             "output": rec.output,
         }
-        for rec in action_history[-40:]
+        for rec in recent_actions
     ]
+    # Key order matters for provider prompt caching: everything that stays fixed across the
+    # iterations of a run comes first, per-iteration state (iteration, snapshot, actions) last.
     planner_input = {
+        "available_actions": available_actions,
         "original_user_query": original_user_query,
         "conversation_history": conversation_history,
         "conversation_omitted_count": max(0, len(request.messages) - len(recent_messages)),
@@ -772,7 +1334,6 @@ async def plan_actions(
             "summary_enabled": summary_enabled,
             "summary_max_chars": summary_max_chars,
         },
-        "iteration": iteration,
         "runtime_constraints": {
             "chat_only": request.chat_only,
             "force_code_edit": request.force_code_edit,
@@ -788,24 +1349,26 @@ async def plan_actions(
             }
             for s in (request.snippets or [])[:50]
         ],
+        "iteration": iteration,
         "context_snapshot": context_snapshot,
         "prior_actions": history_payload,
-        "available_actions": available_actions,
     }
+    planner_payload = _json_dumps(planner_input)
     messages = [
-        {"role": "system", "content": PLANNER_SYSTEM_PROMPT},
-        {"role": "user", "content": json.dumps(planner_input, ensure_ascii=False)},
+        _PLANNER_SYSTEM_MSG,
+        {"role": "user", "content": planner_payload},
     ]
-    callers = {
-        AIProvider.OPENAI: call_openai,
-        AIProvider.CLAUDE: call_claude,
-        AIProvider.CUSTOM: call_custom,
-    }
-    caller = callers.get(provider, call_openai)
-    raw, llm_call = await caller(messages)
+    cache_key = _ResponseCache.key(provider, planner_payload)
+    cached = _PLANNER_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    caller = _PROVIDER_CALLERS.get(provider, call_openai)
+    raw, llm_call = await caller(messages, on_token=on_token)
     try:
         batch = _parse_action_batch_response(raw, iteration=iteration)
         batch.llm_call = llm_call
+        if batch.decision.mode in _PLANNER_CACHEABLE_MODES:
+            _PLANNER_CACHE.put(cache_key, batch)
         return batch
     except Exception:
         # Safe fallback so orchestrator can continue with user-visible guidance.
@@ -831,6 +1394,85 @@ async def plan_actions(
         )
 
 
+class _CircuitBreaker:
+    """Skips a provider for cooldown_sec after max_failures consecutive failures."""
+
+    def __init__(self, max_failures: int = 3, cooldown_sec: float = 60.0):
+        self.max_failures = max_failures
+        self.cooldown_sec = cooldown_sec
+        self._failures: dict[AIProvider, int] = {}
+        self._opened_at: dict[AIProvider, float] = {}
+
+    def allow(self, provider: AIProvider) -> bool:
+        opened_at = self._opened_at.get(provider)
+        if opened_at is None:
+            return True
+        if time.monotonic() - opened_at >= self.cooldown_sec:
+            # Half-open: let one attempt through; a further failure re-opens immediately.
+            del self._opened_at[provider]
+            self._failures[provider] = self.max_failures - 1
+            return True
+        return False
+
+    def record(self, provider: AIProvider, ok: bool) -> None:
+        if ok:
+            self._failures.pop(provider, None)
+            return
+        failures = self._failures.get(provider, 0) + 1
+        self._failures[provider] = failures
+        if failures >= self.max_failures:
+            self._opened_at[provider] = time.monotonic()
+
+
+_RACE_BREAKER = _CircuitBreaker()
+
+
+async def _race_providers(
+    primary: AIProvider, secondary: AIProvider, built: list[dict]
+) -> tuple[str, dict, AIProvider]:
+    """Send the same prompt to two providers; return the first successful reply and who sent it."""
+    tasks = {
+        asyncio.ensure_future(_PROVIDER_CALLERS.get(p, call_openai)(built)): p
+        for p in (primary, secondary)
+    }
+    pending = set(tasks)
+    first_error: BaseException | None = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if tasks[task] == secondary:
+                    _RACE_BREAKER.record(secondary, error is None)
+                if error is None:
+                    raw, llm_call = task.result()
+                    return raw, llm_call, tasks[task]
+                if first_error is None or tasks[task] == primary:
+                    first_error = error
+        raise first_error
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def _semantic_store(scope: str, text: str, value: tuple[str, dict]) -> None:
+    # Runs fire-and-forget in the executor, so failures are logged here rather than lost.
+    try:
+        _SEMANTIC_CACHE.store(scope, text, value)
+    except Exception as e:
+        logger.warning(f"Failed to store semantic cache entry: {e}")
+
+
+def _is_usable_reply(parsed: AIResponse, action: str) -> bool:
+    if action in ("modify", "generate"):
+        return parsed.file_content is not None or bool(parsed.changes)
+    if action == "plan":
+        return parsed.plan is not None
+    return bool(parsed.content or parsed.file_content or parsed.changes)
+
+
 async def chat(
     provider: AIProvider,
     messages: list[ChatMessage],
@@ -842,20 +1484,129 @@ async def chat(
     planning_mode: bool = False,
     range_start: int | None = None,
     range_end: int | None = None,
+    on_token: TokenCallback | None = None,
+    race_with: AIProvider | None = None,
+    use_cache: bool = True,
 ) -> AIResponse:
-    action = _infer_action(messages, current_file, file_path, snippets, chat_only, planning_mode, range_start, range_end)
+    """on_token, when given, streams raw text deltas from the provider; the parsed result is still returned.
+
+    race_with sends the prompt to a second provider as well and keeps whichever answers first. It is
+    ignored for planning and streaming calls, and while that provider's circuit breaker is open.
+
+    use_cache=False skips the reply caches (both opt-in), for prompts whose answer must not be replayed.
+    """
+    # Lowercased latest user turn, shared by action inference and snippet-focus detection.
+    latest_user_text = _latest_user_text(messages)
+    action = _infer_action(latest_user_text, current_file, file_path, snippets, chat_only, planning_mode, range_start, range_end)
     built = _build_messages(
         messages, current_file, current_code, action, file_path,
-        snippets, chat_only, planning_mode, range_start, range_end
+        snippets, chat_only, planning_mode, range_start, range_end,
+        latest_user_text=latest_user_text,
     )
 
-    callers = {
-        AIProvider.OPENAI: call_openai,
-        AIProvider.CLAUDE: call_claude,
-        AIProvider.CUSTOM: call_custom,
-    }
-    caller = callers.get(provider, call_openai)
-    raw, llm_call = await caller(built)
+    # Exact repeats (same action and fully built prompt) are served from cache without a provider call.
+    cache_key = None
+    cache_payload = f"{action}\n{_json_dumps(built)}"
+    if use_cache and _LLM_CACHE_TTL > 0:
+        cache_key = _ResponseCache.key(provider, cache_payload)
+    cached = _LLM_CACHE.get(cache_key) if cache_key is not None else None
+
+    # Paraphrases of the latest question, asked against identical history and file context.
+    semantic_scope = None
+    # Only plain chat answers are matched by paraphrase; a similar-sounding edit request must never
+    # replay file content generated for a different instruction.
+    if (
+        cached is None
+        and use_cache
+        and action == "chat"
+        and _SEMANTIC_CACHE is not None
+        and messages
+        and messages[-1].role == "user"
+    ):
+        question = messages[-1].content
+        context_tail = built[-1]["content"][len(question):]
+        semantic_payload = f"{action}\n{_json_dumps(built[:-1])}\n{context_tail}"
+        semantic_scope = "|".join(_ResponseCache.key(provider, semantic_payload))
+        try:
+            cached = await asyncio.to_thread(_SEMANTIC_CACHE.lookup, semantic_scope, question)
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {e}")
+
+    if cached is not None:
+        raw, llm_call = cached
+        llm_call = {**llm_call, "cached": True}
+        if on_token is not None:
+            await on_token(raw)
+    elif (
+        race_with is not None
+        and race_with != provider
+        and action != "plan"
+        and on_token is None
+        and _RACE_BREAKER.allow(race_with)
+    ):
+        raw, llm_call, winner = await _race_providers(provider, race_with, built)
+        if winner != provider:
+            # File the reply under the provider/model that actually produced it.
+            if cache_key is not None:
+                cache_key = _ResponseCache.key(winner, cache_payload)
+            if semantic_scope is not None:
+                semantic_scope = "|".join(_ResponseCache.key(winner, semantic_payload))
+    else:
+        caller = _PROVIDER_CALLERS.get(provider, call_openai)
+        raw, llm_call = await caller(built, on_token=on_token)
     parsed = _parse_ai_response(raw, action)
+    # Replies the caller cannot use (e.g. a modify without file content) are never replayed.
+    if cached is None and _is_usable_reply(parsed, action):
+        if cache_key is not None:
+            _LLM_CACHE.put(cache_key, (raw, llm_call))
+        if semantic_scope is not None:
+            # Embedding the question is not needed for this reply; do it in the background.
+            asyncio.get_running_loop().run_in_executor(
+                None, _semantic_store, semantic_scope, messages[-1].content, (raw, llm_call)
+            )
     parsed.llm_call = llm_call
     return parsed
+
+
+async def chat_stream(
+    provider: AIProvider, messages: list[ChatMessage], **kwargs
+) -> AsyncGenerator[str | AIResponse, None]:
+    """Async-iterator form of chat(): yields raw text deltas as they arrive, then the parsed
+    AIResponse as the last item. On a cache hit the whole cached reply arrives as a single
+    text item before the AIResponse.
+
+    Takes the same keyword arguments as chat() apart from on_token.
+    """
+    queue: asyncio.Queue[str | None] = asyncio.Queue()
+
+    async def on_token(text: str) -> None:
+        queue.put_nowait(text)
+
+    task = asyncio.create_task(chat(provider, messages, on_token=on_token, **kwargs))
+    # Runs after the last delta has been queued, so the sentinel always comes last.
+    task.add_done_callback(lambda _t: queue.put_nowait(None))
+    try:
+        while (text := await queue.get()) is not None:
+            yield text
+        yield task.result()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+_LLM_CONCURRENCY = max(1, int(os.getenv("NEXAR_LLM_CONCURRENCY", "10")))
+
+
+async def chat_batch(provider: AIProvider, requests: list[dict]) -> list[AIResponse | Exception]:
+    """Run several chat() calls concurrently, at most NEXAR_LLM_CONCURRENCY in flight.
+
+    Each item holds chat() keyword arguments (messages, current_file, ...). Results keep the
+    input order; a failed item yields its exception instead of aborting the whole batch.
+    """
+    semaphore = asyncio.Semaphore(_LLM_CONCURRENCY)
+
+    async def run_one(kwargs: dict) -> AIResponse:
+        async with semaphore:
+            return await chat(provider, **kwargs)
+
+    return await asyncio.gather(*(run_one(kwargs) for kwargs in requests), return_exceptions=True)
@@ -1,65 +1,151 @@
+import functools
+import itertools
 import os
 import shutil
+from collections import OrderedDict
 from pathlib import Path
 from backend.models.schemas import FileItem, FileContent
 
 WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", os.path.join(os.path.dirname(__file__), "..", "..", "workspace"))
 
+# Heavy generated/vendored directories the file tree does not descend into or show.
+TREE_EXCLUDED_DIRS = frozenset({"node_modules", ".git", "__pycache__", "venv", "dist", ".next"})
 
+# Bumped by every mutating operation so callers can cheaply detect workspace changes.
+_generation = 0
+
+
+def workspace_generation() -> int:
+    return _generation
+
+
+def _touch() -> None:
+    global _generation
+    _generation += 1
+
+
+def mark_workspace_changed() -> None:
+    """Bump the generation for changes made outside this module, e.g. by a shell command."""
+    _touch()
+
+
+@functools.lru_cache(maxsize=None)
 def get_workspace_root() -> str:
     root = os.path.abspath(WORKSPACE_ROOT)
     os.makedirs(root, exist_ok=True)
     return root
 
 
+# Large buffers keep their line index cached so repeated range edits on the same file skip the scan.
+_LINE_INDEX_MIN_CHARS = 1 << 18
+_LINE_INDEX_CACHE_SIZE = 8
+_line_index_cache: OrderedDict[tuple[int, int], tuple[str, list[int]]] = OrderedDict()
+
+
+def line_offsets(text: str) -> list[int]:
+    """Start offset of every line plus len(text) as the final entry.
+
+    Lines follow str.splitlines() boundaries (\n, \r\n, \r, \x0c, \u2028, ...), the single
+    definition of line numbers for range reads, context windows and range writes.
+    """
+    if len(text) < _LINE_INDEX_MIN_CHARS:
+        return list(itertools.accumulate(map(len, text.splitlines(keepends=True)), initial=0))
+    key = (len(text), hash(text))
+    entry = _line_index_cache.get(key)
+    if entry is not None and entry[0] == text:
+        _line_index_cache.move_to_end(key)
+        return entry[1]
+    offsets = list(itertools.accumulate(map(len, text.splitlines(keepends=True)), initial=0))
+    _line_index_cache[key] = (text, offsets)
+    if len(_line_index_cache) > _LINE_INDEX_CACHE_SIZE:
+        _line_index_cache.popitem(last=False)
+    return offsets
+
+
 def _safe_path(relative_path: str) -> str:
     """Ensure path is within workspace to prevent directory traversal attacks."""
     root = get_workspace_root()
     full = os.path.normpath(os.path.join(root, relative_path))
-    if not full.startswith(root):
+    # Compare against root + separator so a sibling such as "<root>-other" is rejected too.
+    if full != root and not full.startswith(_workspace_prefix()):
         raise ValueError("Path traversal detected")
     return full
 
 
+@functools.lru_cache(maxsize=None)
+def _workspace_prefix() -> str:
+    return os.path.join(get_workspace_root(), "")
+
+
+_EXT_MAP = {
+    ".py": "python", ".js": "javascript", ".ts": "typescript",
+    ".tsx": "typescriptreact", ".jsx": "javascriptreact",
+    ".html": "html", ".css": "css", ".scss": "scss",
+    ".json": "json", ".md": "markdown", ".yaml": "yaml",
+    ".yml": "yaml", ".xml": "xml", ".sql": "sql",
+    ".sh": "shell", ".bash": "shell", ".go": "go",
+    ".rs": "rust", ".java": "java", ".c": "c",
+    ".cpp": "cpp", ".h": "c", ".hpp": "cpp",
+    ".rb": "ruby", ".php": "php", ".swift": "swift",
+    ".kt": "kotlin", ".dart": "dart", ".vue": "vue",
+    ".svelte": "svelte", ".toml": "toml", ".ini": "ini",
+    ".env": "dotenv", ".txt": "plaintext",
+}
+
+
+@functools.lru_cache(maxsize=4096)
 def _get_language(filename: str) -> str:
-    ext_map = {
-        ".py": "python", ".js": "javascript", ".ts": "typescript",
-        ".tsx": "typescriptreact", ".jsx": "javascriptreact",
-        ".html": "html", ".css": "css", ".scss": "scss",
-        ".json": "json", ".md": "markdown", ".yaml": "yaml",
-        ".yml": "yaml", ".xml": "xml", ".sql": "sql",
-        ".sh": "shell", ".bash": "shell", ".go": "go",
-        ".rs": "rust", ".java": "java", ".c": "c",
-        ".cpp": "cpp", ".h": "c", ".hpp": "cpp",
-        ".rb": "ruby", ".php": "php", ".swift": "swift",
-        ".kt": "kotlin", ".dart": "dart", ".vue": "vue",
-        ".svelte": "svelte", ".toml": "toml", ".ini": "ini",
-        ".env": "dotenv", ".txt": "plaintext",
-    }
     _, ext = os.path.splitext(filename)
-    return ext_map.get(ext.lower(), "plaintext")
+    return _EXT_MAP.get(ext.lower(), "plaintext")
 
 
-def list_directory(relative_path: str = "") -> list[FileItem]:
+def list_directory(
+    relative_path: str = "",
+    depth: int | None = None,
+    exclude: frozenset[str] | set[str] = TREE_EXCLUDED_DIRS,
+) -> list[FileItem]:
+    """List a directory tree. depth=None walks the full tree; depth=1 lists only the direct
+    children (subdirectories come back with children=None so the UI can fetch them lazily)."""
     full_path = _safe_path(relative_path)
     if not os.path.isdir(full_path):
         raise FileNotFoundError(f"Directory not found: {relative_path}")
-
-    items = []
+    return _scan_directory(full_path, relative_path, depth, exclude)
+
+
+def _dir_entries(full_path: str) -> list[tuple[bool, str, str]]:
+    # Not cached: the workspace is also changed by the user's terminal and editor, which
+    # neither the generation counter nor a directory mtime reliably reflects.
+    entries = []
+    with os.scandir(full_path) as it:
+        for entry in it:
+            if entry.name.startswith("."):
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            entries.append((not is_dir, entry.name.lower(), entry.name))
+    entries.sort()
+    return [(not is_file, name, os.path.join(full_path, name)) for is_file, _, name in entries]
+
+
+def _scan_directory(
+    full_path: str, relative_path: str, depth: int | None, exclude: frozenset[str] | set[str]
+) -> list[FileItem]:
+    # full_path is already validated, so subdirectories skip _safe_path.
     try:
-        entries = sorted(os.listdir(full_path), key=lambda x: (not os.path.isdir(os.path.join(full_path, x)), x.lower()))
-    except PermissionError:
-        return items
+        entries = _dir_entries(full_path)
+    except (PermissionError, FileNotFoundError):
+        return []
 
-    for entry in entries:
-        if entry.startswith("."):
+    items = []
+    for is_dir, name, entry_path in entries:
+        if is_dir and name in exclude:
             continue
-        entry_full = os.path.join(full_path, entry)
-        entry_rel = os.path.join(relative_path, entry) if relative_path else entry
-        is_dir = os.path.isdir(entry_full)
-        item = FileItem(name=entry, path=entry_rel, is_dir=is_dir)
-        if is_dir:
-            item.children = list_directory(entry_rel)
+        entry_rel = os.path.join(relative_path, name) if relative_path else name
+        item = FileItem(name=name, path=entry_rel, is_dir=is_dir)
+        if is_dir and (depth is None or depth > 1):
+            item.children = _scan_directory(entry_path, entry_rel, None if depth is None else depth - 1, exclude)
         items.append(item)
     return items
 
@@ -78,6 +164,7 @@ def write_file(relative_path: str, content: str) -> FileContent:
     os.makedirs(os.path.dirname(full_path), exist_ok=True)
     with open(full_path, "w", encoding="utf-8") as f:
         f.write(content)
+    _touch()
     return FileContent(path=relative_path, content=content, language=_get_language(relative_path))
 
 
@@ -85,20 +172,36 @@ def write_file_range(relative_path: str, replacement: str, start_line: int, end_
     if start_line < 1 or end_line < start_line:
         raise ValueError("Invalid range: range_start/range_end must satisfy 1 <= range_start <= range_end")
 
-    current = read_file(relative_path)
-    lines = current.content.splitlines(keepends=True)
+    full_path = _safe_path(relative_path)
+    if not os.path.isfile(full_path):
+        raise FileNotFoundError(f"File not found: {relative_path}")
+    with open(full_path, "rb") as f:
+        data = f.read()
 
-    if not lines:
+    if not data:
         if start_line != 1 or end_line != 1:
             raise ValueError("Invalid range for empty file: only 1-1 is allowed")
         return write_file(relative_path, replacement)
 
-    total = len(lines)
-    if end_line > total:
-        raise ValueError(f"Invalid range: file has {total} lines, but range_end={end_line}")
-
-    new_content = "".join(lines[: start_line - 1]) + replacement + "".join(lines[end_line:])
-    return write_file(relative_path, new_content)
+    # Same line boundaries as range reads and context windows (line_offsets); surrogateescape
+    # carries any bytes that are not valid UTF-8 through the splice unchanged.
+    text = data.decode("utf-8", errors="surrogateescape")
+    offsets = line_offsets(text)
+    line_count = len(offsets) - 1
+    if end_line > line_count:
+        raise ValueError(f"Invalid range: file has {line_count} lines, but range_end={end_line}")
+
+    new_text = text[:offsets[start_line - 1]] + replacement + text[offsets[end_line]:]
+    new_data = new_text.encode("utf-8", errors="surrogateescape")
+    # Written in place like write_file, so symlinks and file modes are left as they are.
+    with open(full_path, "wb") as f:
+        f.write(new_data)
+    _touch()
+    return FileContent(
+        path=relative_path,
+        content=new_data.decode("utf-8", errors="replace"),
+        language=_get_language(relative_path),
+    )
 
 
 def create_item(relative_path: str, is_dir: bool = False, content: str = "") -> bool:
@@ -109,6 +212,7 @@ def create_item(relative_path: str, is_dir: bool = False, content: str = "") ->
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
         with open(full_path, "w", encoding="utf-8") as f:
             f.write(content)
+    _touch()
     return True
 
 
@@ -120,6 +224,7 @@ def delete_item(relative_path: str) -> bool:
         os.remove(full_path)
     else:
         raise FileNotFoundError(f"Not found: {relative_path}")
+    _touch()
     return True
 
 
@@ -130,4 +235,5 @@ def rename_item(old_path: str, new_path: str) -> bool:
         raise FileNotFoundError(f"Not found: {old_path}")
     os.makedirs(os.path.dirname(new_full), exist_ok=True)
     shutil.move(old_full, new_full)
+    _touch()
     return True
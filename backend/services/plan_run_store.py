@@ -4,10 +4,16 @@ import json
 import logging
 import os
 import threading
+import time
 import uuid
-from datetime import datetime
+from collections import OrderedDict
 from typing import Any
 
+try:
+    import orjson
+except ImportError:  # stdlib fallback keeps the store usable without the C extension
+    orjson = None
+
 from backend.models.schemas import (
     AIRequest,
     AIRequestSnapshot,
@@ -23,21 +29,231 @@ PLAN_RUN_DIR = os.path.join(LOG_DIR, "plan_runs")
 os.makedirs(PLAN_RUN_DIR, exist_ok=True)
 logger = logging.getLogger("plan_run_store")
 
+# Mutations land in a process-wide cache and are written out by one coalescing timer, so a
+# burst of events costs a single rewrite per run. The state is module level because the agent
+# and the router each hold their own PlanRunStore instance.
+# On disk a run is split in two: {run_id}.json holds everything but the events and is
+# rewritten on flush, {run_id}.events.jsonl only ever gets the new events appended.
+_FLUSH_DELAY_SEC = 0.1
+_CACHE_MAX_RUNS = 256
+_EVENT_HANDLES_MAX = 64
+_RUNS: OrderedDict[str, PlanRunInfo] = OrderedDict()
+_DIRTY: set[str] = set()
+_EVENTS_WRITTEN: dict[str, int] = {}
+_EVENT_HANDLES: OrderedDict[str, Any] = OrderedDict()
+_LOCK = threading.RLock()
+# Taken before _LOCK, never while holding it. Guards the files, the event handles and _EVENTS_WRITTEN.
+_IO_LOCK = threading.Lock()
+_flush_timer: threading.Timer | None = None
+
+
+_ts_cache: tuple[int, str] = (-1, "")
+
+
+def _utc_now_iso() -> str:
+    """Same string as datetime.utcnow().isoformat(); the date/time part is formatted once per second."""
+    global _ts_cache
+    second, micros = divmod(time.time_ns() // 1000, 1_000_000)
+    if second != _ts_cache[0]:
+        _ts_cache = (second, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second)))
+    prefix = _ts_cache[1]
+    return f"{prefix}.{micros:06d}" if micros else prefix
+
+
+def _dumpb(obj, indent: bool = False) -> bytes:
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+
+def _loads(data: str | bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _schedule_flush() -> None:
+    global _flush_timer
+    if _flush_timer is None:
+        _flush_timer = threading.Timer(_FLUSH_DELAY_SEC, flush_all)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+
+
+def _event_handle(run_id: str, truncate: bool = False):
+    f = _EVENT_HANDLES.pop(run_id, None)
+    if f is not None and truncate:
+        f.close()
+        f = None
+    if f is None:
+        f = open(_events_path(run_id), "wb" if truncate else "ab", buffering=65536)
+    _EVENT_HANDLES[run_id] = f
+    while len(_EVENT_HANDLES) > _EVENT_HANDLES_MAX:
+        _EVENT_HANDLES.popitem(last=False)[1].close()
+    return f
+
+
+def _snapshot(run_id: str) -> tuple[dict, list[ExecutionEvent], int, bool] | None:
+    # Caller holds _LOCK and _IO_LOCK. Only the header dict and the unwritten event slice are
+    # taken here; events are append-only and immutable, so they can be serialized after
+    # _LOCK is released.
+    if run_id not in _DIRTY:
+        return None
+    _DIRTY.discard(run_id)
+    run = _RUNS.get(run_id)
+    if run is None:
+        return None
+    written = _EVENTS_WRITTEN.get(run_id, 0)
+    rewrite = written < 0 or written > len(run.events)
+    if rewrite:
+        written = 0
+    header = run.model_dump(mode="json", exclude={"events"})
+    # Count only what this slice holds: events appended after it are picked up next flush.
+    return header, run.events[written:], written, rewrite
+
+
+def _write_snapshot(
+    run_id: str, header: dict, new_events: list[ExecutionEvent], written: int, rewrite: bool
+) -> None:
+    # Caller holds _IO_LOCK but not _LOCK. The sidecar goes first and the header, taken from
+    # the same snapshot, records how many events it covers; a reader never trusts more.
+    if new_events or rewrite:
+        try:
+            f = _event_handle(run_id, truncate=rewrite)
+            f.write(b"".join(
+                _dumpb(e.model_dump(mode="json")) + b"\n"
+                for e in new_events
+            ))
+            f.flush()
+        except Exception:
+            # The sidecar may now end in a partial line; rebuild it on the retry.
+            _EVENTS_WRITTEN[run_id] = -1
+            raise
+    event_count = written + len(new_events)
+    _EVENTS_WRITTEN[run_id] = event_count
+    path = _run_path(run_id)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb", buffering=65536) as f:
+        f.write(_dumpb({**header, "event_count": event_count}))
+    os.replace(tmp, path)
+
+
+def _read_run(run_id: str) -> PlanRunInfo:
+    with open(_run_path(run_id), "rb") as f:
+        data = _loads(f.read())
+    event_count = data.pop("event_count", None)
+    events_path = _events_path(run_id)
+    if os.path.isfile(events_path):
+        events = []
+        clean = True
+        with open(events_path, "rb") as f:
+            for line in f:
+                if event_count is not None and len(events) == event_count:
+                    # Appended by a flush whose header never landed.
+                    clean = False
+                    break
+                try:
+                    events.append(_loads(line))
+                except ValueError:
+                    # A torn tail from an interrupted append; everything before it is intact.
+                    logger.warning("[PlanRunStore] skipping malformed event line run_id=%s", run_id)
+                    clean = False
+                    break
+        data["events"] = events
+        # Anything past what was kept is rewritten rather than appended after.
+        _EVENTS_WRITTEN[run_id] = len(events) if clean else -1
+    else:
+        # Files written before the events sidecar existed keep events inline.
+        _EVENTS_WRITTEN[run_id] = 0
+    return PlanRunInfo(**data)
+
+
+def _flush_one(run_id: str) -> None:
+    # Caller must not hold _LOCK: the snapshot is taken under it and the files are written
+    # after it is released, so mutations are never blocked on disk I/O. _IO_LOCK orders the
+    # writes, so an older snapshot can never land on top of a newer one.
+    with _IO_LOCK:
+        with _LOCK:
+            snapshot = _snapshot(run_id)
+        if snapshot is None:
+            return
+        try:
+            _write_snapshot(run_id, *snapshot)
+        except Exception as e:
+            # Keep the run pending so the next flush retries it instead of dropping the write.
+            with _LOCK:
+                _DIRTY.add(run_id)
+            logger.error("[PlanRunStore] flush failed run_id=%s: %s", run_id, e)
+
+
+def flush_all() -> None:
+    """Write every pending run to disk; called by the timer and on shutdown."""
+    global _flush_timer
+    with _LOCK:
+        _flush_timer = None
+        pending = list(_DIRTY)
+    for run_id in pending:
+        _flush_one(run_id)
+    with _LOCK:
+        if _DIRTY and _flush_timer is None:
+            _schedule_flush()
+
+
+def close() -> None:
+    """Flush pending runs and close the cached event log handles."""
+    flush_all()
+    with _IO_LOCK:
+        while _EVENT_HANDLES:
+            _EVENT_HANDLES.popitem()[1].close()
+
+
+def _cache_put(run: PlanRunInfo) -> None:
+    _RUNS[run.run_id] = run
+    _RUNS.move_to_end(run.run_id)
+    if len(_RUNS) > _CACHE_MAX_RUNS:
+        for run_id in list(_RUNS):
+            if len(_RUNS) <= _CACHE_MAX_RUNS:
+                break
+            if run_id not in _DIRTY:
+                del _RUNS[run_id]
+
+
+def _detached_copy(run: PlanRunInfo) -> PlanRunInfo:
+    # Callers mutate what they get back, so everything is deep-copied except the events:
+    # those are append-only and never modified once recorded, so the copy shares the
+    # ExecutionEvent objects and only gets its own list. That keeps get() from cloning the
+    # whole event history on every call.
+    events = run.events
+    copy = run.model_copy(update={"events": []}).model_copy(deep=True)
+    copy.events = list(events)
+    return copy
+
+
+def _run_path(run_id: str) -> str:
+    safe_id = run_id.replace("/", "_")
+    return os.path.join(PLAN_RUN_DIR, f"{safe_id}.json")
+
+
+def _events_path(run_id: str) -> str:
+    safe_id = run_id.replace("/", "_")
+    return os.path.join(PLAN_RUN_DIR, f"{safe_id}.events.jsonl")
+
 
 class PlanRunStore:
-    """Persistent run store backed by JSON files."""
+    """Persistent run store backed by JSON files, with write-behind caching."""
 
     def __init__(self):
-        self._lock = threading.Lock()
+        self._lock = _LOCK
 
     def create_run(self, intent: str, max_retries: int, request: AIRequest | AIRequestSnapshot) -> PlanRunInfo:
-        snapshot = request if isinstance(request, AIRequestSnapshot) else AIRequestSnapshot(**request.model_dump())
+        snapshot = request if isinstance(request, AIRequestSnapshot) else AIRequestSnapshot.model_validate(request, from_attributes=True)
         run = PlanRunInfo(
             run_id=str(uuid.uuid4()),
             intent=intent,
             status="running",
             max_retries=max_retries,
-            started_at=datetime.utcnow().isoformat(),
+            started_at=_utc_now_iso(),
             request_snapshot=snapshot,
         )
         self.save(run)
@@ -45,20 +261,36 @@ class PlanRunStore:
         return run
 
     def save(self, run: PlanRunInfo) -> PlanRunInfo:
-        path = self._path(run.run_id)
+        """Mark the run dirty; the disk write is coalesced with other mutations."""
         with self._lock:
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(run.model_dump(mode="json"), f, ensure_ascii=False, indent=2)
+            _cache_put(run)
+            _DIRTY.add(run.run_id)
+            _schedule_flush()
         return run
 
+    def flush(self, run_id: str) -> None:
+        """Write the run to disk now (checkpoint for run completion)."""
+        _flush_one(run_id)
+
+    def export_run(self, run_id: str) -> str:
+        """Pretty-printed JSON of the full run, events included; the files on disk are compact."""
+        return _dumpb(self.get(run_id).model_dump(mode="json"), indent=True).decode("utf-8")
+
     def get(self, run_id: str) -> PlanRunInfo:
+        with self._lock:
+            run = _RUNS.get(run_id)
+            if run is not None:
+                return _detached_copy(run)
         path = self._path(run_id)
         if not os.path.isfile(path):
             raise FileNotFoundError(f"Plan run not found: {run_id}")
+        with _IO_LOCK:
+            run = _read_run(run_id)
         with self._lock:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        return PlanRunInfo(**data)
+            if run_id in _RUNS:
+                return _detached_copy(_RUNS[run_id])
+            _cache_put(run)
+        return _detached_copy(run)
 
     def set_latest_batch(self, run: PlanRunInfo, batch: ActionBatch) -> PlanRunInfo:
         run.latest_batch = batch
@@ -105,14 +337,15 @@ class PlanRunStore:
         run.cancel_requested = True
         if run.status in {"waiting_user", "paused"}:
             run.status = "cancelled"
-            run.finished_at = datetime.utcnow().isoformat()
+            run.finished_at = _utc_now_iso()
         self.save(run)
         return run
 
     def mark_run_finished(self, run: PlanRunInfo, status: str) -> PlanRunInfo:
         run.status = status
-        run.finished_at = datetime.utcnow().isoformat()
+        run.finished_at = _utc_now_iso()
         self.save(run)
+        self.flush(run.run_id)
         return run
 
     def mark_run_result(self, run: PlanRunInfo, result: AIResponse | None) -> PlanRunInfo:
@@ -124,6 +357,7 @@ class PlanRunStore:
         run.result_file_content = result.file_content
         run.result_changes = result.changes or []
         self.save(run)
+        self.flush(run.run_id)
         return run
 
     def add_event(
@@ -152,7 +386,7 @@ class PlanRunStore:
             title=title,
             detail=detail,
             status=status,
-            timestamp=datetime.utcnow().isoformat(),
+            timestamp=_utc_now_iso(),
             iteration=iteration,
             action_id=action_id,
             parent_action_id=parent_action_id,
@@ -163,10 +397,10 @@ class PlanRunStore:
             artifacts=artifacts or [],
             error=error,
         )
-        run.events.append(event)
-        self.save(run)
+        with self._lock:
+            run.events.append(event)
+            self.save(run)
         return run
 
     def _path(self, run_id: str) -> str:
-        safe_id = run_id.replace("/", "_")
-        return os.path.join(PLAN_RUN_DIR, f"{safe_id}.json")
+        return _run_path(run_id)
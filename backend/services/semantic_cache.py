@@ -0,0 +1,121 @@
+"""Near-duplicate prompt cache for chat(), keyed on an embedding of the latest user turn.
+
+Optional: it needs numpy and sentence-transformers, and is only active when
+NEXAR_SEMANTIC_CACHE=1. Entries are grouped by a caller-supplied scope (history, file
+context, provider/model), so a paraphrase only matches answers given for the same context.
+"""
+import json
+import logging
+import os
+import threading
+
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # optional dependencies; the cache simply stays disabled
+    np = None
+    SentenceTransformer = None
+
+logger = logging.getLogger("semantic_cache")
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        model_name: str = DEFAULT_MODEL,
+        threshold: float = 0.92,
+        max_entries: int = 512,
+        path: str | None = None,
+    ):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.path = path
+        self._lock = threading.Lock()
+        self._model = None
+        self._loaded = False
+        # Insertion-ordered parallel lists; embeddings are unit-normalised float32 vectors.
+        self._scopes: list[str] = []
+        self._vectors: list = []
+        self._values: list[tuple[str, dict]] = []
+
+    @property
+    def available(self) -> bool:
+        return np is not None and SentenceTransformer is not None
+
+    def _ensure_loaded(self) -> None:
+        if self._model is None:
+            self._model = SentenceTransformer(self.model_name)
+        if not self._loaded:
+            self._loaded = True
+            if self.path and os.path.exists(self.path):
+                self._load(self.path)
+
+    def _embed(self, text: str):
+        return self._model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+    def lookup(self, scope: str, text: str) -> tuple[str, dict] | None:
+        """Blocking (embeds text); run it off the event loop."""
+        with self._lock:
+            self._ensure_loaded()
+            idx = [i for i, s in enumerate(self._scopes) if s == scope]
+            if not idx:
+                return None
+            vec = self._embed(text)
+            sims = np.stack([self._vectors[i] for i in idx]) @ vec
+            best = int(sims.argmax())
+            if float(sims[best]) < self.threshold:
+                return None
+            return self._values[idx[best]]
+
+    def store(self, scope: str, text: str, value: tuple[str, dict]) -> None:
+        """Blocking (embeds text); run it off the event loop."""
+        with self._lock:
+            self._ensure_loaded()
+            self._scopes.append(scope)
+            self._vectors.append(self._embed(text))
+            self._values.append(value)
+            overflow = len(self._scopes) - self.max_entries
+            if overflow > 0:
+                del self._scopes[:overflow], self._vectors[:overflow], self._values[:overflow]
+
+    def _values_path(self) -> str:
+        return f"{os.path.splitext(self.path)[0]}.values.json"
+
+    def save(self) -> None:
+        if not self.path or not self._loaded:
+            return
+        with self._lock:
+            if not self._scopes:
+                return
+            # Prompt copies are dropped; they are large and already in the interaction log.
+            values = [[raw, {k: v for k, v in meta.items() if k != "prompt_messages"}] for raw, meta in self._values]
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Replies go to a JSON sidecar: a numpy unicode array would pad every entry to the
+            # longest reply. The sidecar is written first and _load checks the counts agree.
+            values_path = self._values_path()
+            with open(f"{values_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(values, f, ensure_ascii=False)
+            os.replace(f"{values_path}.tmp", values_path)
+            tmp = f"{self.path}.tmp.npz"
+            np.savez(tmp, vectors=np.stack(self._vectors), scopes=np.array(self._scopes))
+            os.replace(tmp, self.path)
+
+    def _load(self, path: str) -> None:
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                vectors, scopes = data["vectors"], data["scopes"]
+            with open(self._values_path(), "r", encoding="utf-8") as f:
+                values = json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load semantic cache {path}: {e}")
+            return
+        if not (len(vectors) == len(scopes) == len(values)):
+            logger.warning(f"Semantic cache {path} is inconsistent with its values file; ignoring it")
+            return
+        keep = slice(max(0, len(scopes) - self.max_entries), len(scopes))
+        self._vectors = list(vectors[keep])
+        self._scopes = [str(s) for s in scopes[keep]]
+        self._values = [tuple(v) for v in values[keep]]
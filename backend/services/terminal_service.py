@@ -1,16 +1,20 @@
+import codecs
 import os
 import pty
-import select
 import signal
 import subprocess
 import uuid
 import fcntl
 import termios
 import struct
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from threading import Lock
 from typing import Optional
 
+_READ_CHUNK = 1 << 16
+# Upper bound per poll so a process flooding the pty cannot pin the caller in one read.
+_READ_MAX = 1 << 20
+
 
 @dataclass
 class TerminalSession:
@@ -19,6 +23,11 @@ class TerminalSession:
     master_fd: int
     cwd: str
     shell: str
+    # Reused across polls; the incremental decoder carries a UTF-8 sequence split between reads.
+    read_buffer: bytearray = field(default_factory=bytearray)
+    decoder: codecs.IncrementalDecoder = field(
+        default_factory=lambda: codecs.getincrementaldecoder("utf-8")(errors="replace")
+    )
 
 
 class TerminalSessionManager:
@@ -88,30 +97,38 @@ class TerminalSessionManager:
 
     def read_output(self, session_id: str) -> tuple[str, bool, Optional[int]]:
         session = self.get_session(session_id)
-        chunks: list[bytes] = []
-        while True:
-            readable, _, _ = select.select([session.master_fd], [], [], 0)
-            if not readable:
-                break
+        # master_fd is non-blocking, so BlockingIOError marks the end of pending output.
+        buf = session.read_buffer
+        while len(buf) < _READ_MAX:
             try:
-                part = os.read(session.master_fd, 4096)
-            except BlockingIOError:
-                break
+                part = os.read(session.master_fd, _READ_CHUNK)
             except OSError:
                 break
             if not part:
                 break
-            chunks.append(part)
-        output = b"".join(chunks).decode("utf-8", errors="replace")
+            buf += part
         exit_code = session.process.poll()
         alive = exit_code is None
+        output = session.decoder.decode(buf, final=not alive)
+        buf.clear()
         return output, alive, exit_code
 
     def close_session(self, session_id: str) -> None:
-        with self._lock:
-            session = self._sessions.pop(session_id, None)
+        session = self.detach_session(session_id)
         if not session:
             return
+        try:
+            self.terminate_session(session)
+        finally:
+            self.release_session(session)
+
+    def detach_session(self, session_id: str) -> Optional[TerminalSession]:
+        """Unregister the session so no further reads/writes can look it up."""
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def terminate_session(self, session: TerminalSession) -> None:
+        """Stop the shell; may block up to 1.5s waiting for it. Does not touch master_fd."""
         try:
             if session.process.poll() is None:
                 os.killpg(os.getpgid(session.process.pid), signal.SIGTERM)
@@ -122,8 +139,9 @@ class TerminalSessionManager:
                     os.killpg(os.getpgid(session.process.pid), signal.SIGKILL)
             except Exception:
                 pass
-        finally:
-            try:
-                os.close(session.master_fd)
-            except OSError:
-                pass
+
+    def release_session(self, session: TerminalSession) -> None:
+        try:
+            os.close(session.master_fd)
+        except OSError:
+            pass